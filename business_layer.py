@@ -1,6 +1,24 @@
+import csv
+import json
+import logging
+import math
+import os
+import queue
+import socket
+import threading
+import time
+import uuid
+from string import Template
+from contextlib import contextmanager
+from datetime import date
 import tkinter as tk
 from abc import ABC, abstractmethod
-from data_layer import PizzaStore, Ingredient, AbstractInventory, Ingredient, AbstractMenu
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice, repeat
+from data_layer import (PizzaStore, Ingredient, AbstractInventory, Ingredient, AbstractMenu, StoreRouter, ConsumptionHistory,
+                        IngredientAttributes, TicketSpool, ChangeLog, Recipe, event_bus, delete_matching, read_log)
+
+logger = logging.getLogger(__name__)
 
 
 #  RECIPE  MANAGEMENT
@@ -34,32 +52,70 @@ class AbstractStore(ABC):
         pass
 
 class RecipeManager(AbstractStore):
-    def __init__(self):
+    def __init__(self, dietary_engine=None):
         self.store = PizzaStore()
+        # Allergen and diet facets come from the same attribute table as the menu's dietary filters
+        self.dietary_engine = dietary_engine or DietaryEngine()
+        self.facets = FacetIndex(self.dietary_engine.record_facets)
+        # The index is built on the first facet query, so loading never reads every recipe
+        self.facets_stale = False
 
-    def add_recipe(self, recipe):
-        self.store.add_recipe(recipe)
+    def facet_index(self):
+        if self.facets_stale:
+            self.facets.rebuild(self.store.recipes)
+            self.facets_stale = False
+        return self.facets
+
+    def add_recipe(self, recipe, index=None):
+        self.store.add_recipe(recipe, index)
+        if index is None or index >= len(self.store.recipes) - 1:
+            if not self.facets_stale:
+                self.facets.add(recipe)
+        else:
+            # Facet slots follow the list order, which an insert in the middle shifts
+            self.facets_stale = True
 
     def delete_recipe(self, recipe):
         self.store.delete_recipe(recipe)
+        if not self.facets_stale:
+            self.facets.remove(recipe)
 
     def update_recipe(self, old_recipe, new_recipe):
         self.store.update_recipe(old_recipe, new_recipe)
+        if not self.facets_stale:
+            self.facets.replace(old_recipe, new_recipe)
 
     def get_recipes_by_category(self, category):
         return self.store.get_recipes_by_category(category)
 
+    def filter_recipes(self, selection, exclude=None):
+        return self.facet_index().filter(selection, exclude)
+
+    def get_facet_counts(self, selection=None):
+        return self.facet_index().counts(selection)
+
     def search_recipes(self, search_term):
         return self.store.search_recipes(search_term)
 
+    def iter_recipes(self, search_term=None, category=None):
+        return self.store.iter_recipes(search_term, category)
+
     def save_to_file(self, filename):
         self.store.save_to_file(filename)
 
     def load_from_file(self, filename):
         self.store.load_from_file(filename)
+        self.dietary_engine.load_attributes(filename)
+        self.facets_stale = True
+
+    def load_from_snapshot(self, filename):
+        loaded = self.store.load_from_snapshot(filename)
+        self.dietary_engine.load_attributes(filename)
+        self.facets_stale = True
+        return loaded
 
     def get_all_recipes(self):
-        return self.store.recipes
+        return self.store.get_all_recipes()
 
 
 #  INVENTORY  MANAGEMENT
@@ -88,10 +144,15 @@ class AbstractInventoryManager(ABC):
     def update_ingredient(self, name, stock):
         pass
 
+    @abstractmethod
+    def update_ingredient_cost(self, name, cost):
+        pass
+
 
 class InventoryManager(AbstractInventoryManager):
-    def __init__(self, inventory: AbstractInventory):
+    def __init__(self, inventory: AbstractInventory, history: ConsumptionHistory = None):
         self.inventory = inventory
+        self.history = history or ConsumptionHistory()
 
     def add_ingredient(self, name, stock):
         ingredient = Ingredient(name, stock)
@@ -102,15 +163,97 @@ class InventoryManager(AbstractInventoryManager):
 
     def save_inventory_to_json(self, filename):
         self.inventory.save_to_json(filename)
+        self.history.save_to_json(filename)
 
     def load_inventory_from_json(self, filename):
         self.inventory.load_from_json(filename)
+        self.history.load_from_json(filename)
     
     def delete_ingredient(self, name):
         self.inventory.delete_ingredient(name)
 
-    def update_ingredient(self, name, stock):
+    def update_ingredient(self, name, stock, day=None):
+        # A drop in stock is recorded as consumption, an increase is a delivery.
+        # Returns the quantity recorded so an undo can take it back.
+        consumed = 0
+        for ingredient in self.inventory.get_ingredients():
+            if ingredient.name == name:
+                if stock < ingredient.stock:
+                    consumed = ingredient.stock - stock
+                    self.history.record(name, consumed, day)
+                break
         self.inventory.update_ingredient(name, stock)
+        return consumed
+
+    def update_ingredient_cost(self, name, cost):
+        self.inventory.update_ingredient_cost(name, cost)
+
+    def get_reorder_suggestions(self, **settings):
+        forecaster = DemandForecaster(**settings)
+        return forecaster.suggest_reorders(self.get_inventory(), self.history)
+
+class DemandForecaster:
+    def __init__(self, method='exponential', alpha=0.3, window=7, lead_time_days=2, review_days=7, service_factor=1.65):
+        self.method = method
+        self.alpha = alpha
+        self.window = window
+        self.lead_time_days = lead_time_days
+        self.review_days = review_days
+        self.service_factor = service_factor
+
+    # Each model works a whole day at a time across every ingredient column
+    def moving_average(self, rows):
+        recent = rows[-self.window:]
+        return [sum(column) / len(recent) for column in zip(*recent)]
+
+    def exponential_smoothing(self, rows):
+        levels = list(rows[0])
+        alpha = self.alpha
+        for row in rows[1:]:
+            levels = [alpha * used + (1 - alpha) * level for used, level in zip(row, levels)]
+        return levels
+
+    def deviations(self, rows, means):
+        count = len(rows)
+        if count < 2:
+            return [0.0] * len(means)
+        squares = [0.0] * len(means)
+        for row in rows:
+            squares = [total + (used - mean) ** 2 for total, used, mean in zip(squares, row, means)]
+        return [math.sqrt(total / (count - 1)) for total in squares]
+
+    def forecast(self, names, history: ConsumptionHistory):
+        rows = history.as_matrix(names)
+        if not rows:
+            return {name: (0.0, 0.0) for name in names}
+        if self.method == 'moving_average':
+            demand = self.moving_average(rows)
+        elif self.method == 'exponential':
+            demand = self.exponential_smoothing(rows)
+        else:
+            raise ValueError(f"Unknown forecasting method: {self.method}")
+        averages = [sum(column) / len(rows) for column in zip(*rows)]
+        return dict(zip(names, zip(demand, self.deviations(rows, averages))))
+
+    def suggest_reorders(self, ingredients, history: ConsumptionHistory):
+        forecasts = self.forecast([ingredient.name for ingredient in ingredients], history)
+        suggestions = []
+        for ingredient in ingredients:
+            daily_demand, deviation = forecasts[ingredient.name]
+            safety_stock = self.service_factor * deviation * math.sqrt(self.lead_time_days)
+            reorder_point = daily_demand * self.lead_time_days + safety_stock
+            quantity = 0
+            if ingredient.stock <= reorder_point:
+                target = daily_demand * (self.lead_time_days + self.review_days) + safety_stock
+                quantity = math.ceil(target - ingredient.stock)
+            suggestions.append({
+                'name': ingredient.name,
+                'stock': ingredient.stock,
+                'daily_demand': daily_demand,
+                'reorder_point': reorder_point,
+                'suggested_quantity': max(quantity, 0),
+            })
+        return suggestions
 
 #  MENU  MANAGEMENT
 class AbstractMenuStore(ABC):
@@ -134,14 +277,25 @@ class PizzaMenuStore(AbstractMenuStore):
     def __init__(self, data_handler: AbstractMenu):
         self.data_handler = data_handler
         self.menu = {}
+        # Turned off while an edit session decides when to write
+        self.autosave = True
 
     def load_data(self):
         self.data_handler.load_menu()
         self.menu = self.data_handler.menu
 
     def save_data(self):
+        if self.autosave:
+            self.write_data()
+
+    def publish(self, event_type, data):
+        # Menus can differ per store, so their events say which one
+        event_bus.publish(event_type, dict(data, store=self.data_handler.store_id))
+
+    def write_data(self):
         self.data_handler.menu = self.menu
         self.data_handler.save_menu()
+        menu_view_cache.invalidate(self.data_handler.menu_file)
 
     def add_pizza_to_menu(self, name, description, ingredients, price):
         pizza = {'name': name, 'description': description, 'ingredients': ingredients, 'price': price}
@@ -151,6 +305,7 @@ class PizzaMenuStore(AbstractMenuStore):
         else:
             self.menu['Pizza'] = [pizza]
 
+        self.publish('menu_item_added', {'category': 'Pizza', 'item': pizza})
         self.save_data()
 
     def add_side_dish_to_menu(self, name, description, price):
@@ -161,6 +316,7 @@ class PizzaMenuStore(AbstractMenuStore):
         else:
             self.menu['Side Dish'] = [side_dish]
 
+        self.publish('menu_item_added', {'category': 'Side Dish', 'item': side_dish})
         self.save_data()
 
     def update_pizza_in_menu(self, old_name, new_name, description, ingredients, price):
@@ -171,6 +327,7 @@ class PizzaMenuStore(AbstractMenuStore):
                     pizza['description'] = description
                     pizza['ingredients'] = ingredients
                     pizza['price'] = price
+                    self.publish('menu_item_updated', {'category': 'Pizza', 'old_name': old_name, 'item': pizza})
                     self.save_data()
                     break
 
@@ -181,17 +338,1667 @@ class PizzaMenuStore(AbstractMenuStore):
                     side_dish['name'] = new_name
                     side_dish['description'] = description
                     side_dish['price'] = price
+                    self.publish('menu_item_updated', {'category': 'Side Dish', 'old_name': old_name, 'item': side_dish})
                     self.save_data()
                     break
     
     def delete_item_from_menu(self, category, name):
-        if category in self.menu and name in [item['name'] for item in self.menu[category]]:
-            self.menu[category] = [item for item in self.menu[category] if item['name'] != name]
+        if category in self.menu and any(item['name'] == name for item in self.menu[category]):
+            delete_matching(self.menu[category], lambda item: item['name'] == name)
+            self.publish('menu_item_deleted', {'category': category, 'name': name})
             self.save_data()
 
     def get_item_by_name(self, category, name):
-        if category in self.menu and name in [item['name'] for item in self.menu[category]]:
-            return next(item for item in self.menu[category] if item['name'] == name)
+        return next((item for item in self.menu.get(category, []) if item['name'] == name), None)
+
+
+
+#  CHAIN  REPORTING
+def summarize_store(router: StoreRouter, store_id):
+    inventory = router.load_inventory(store_id)
+    menu = router.load_menu(store_id)
+    return {
+        'store': store_id,
+        'stock': {ingredient.name: ingredient.stock for ingredient in inventory.get_ingredients()},
+        'menu_items': {category: len(items) for category, items in menu.items()},
+    }
+
+class ChainReport:
+    def __init__(self, router: StoreRouter, max_workers=None):
+        self.router = router
+        self.max_workers = max_workers
+
+    def collect(self):
+        # Each store shard is loaded and summarised in its own worker process
+        stores = self.router.list_stores()
+        with ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+            return list(executor.map(summarize_store, repeat(self.router), stores))
+
+    def stock_totals(self, summaries=None):
+        totals = {}
+        for summary in summaries or self.collect():
+            for name, stock in summary['stock'].items():
+                totals[name] = totals.get(name, 0) + stock
+        return totals
+
+    def low_stock(self, threshold, summaries=None):
+        return {
+            summary['store']: sorted(name for name, stock in summary['stock'].items() if stock < threshold)
+            for summary in summaries or self.collect()
+        }
+
+
+#  COSTING
+COSTING_EVENTS = ('cost_changed', 'ingredient_added', 'recipe_added', 'recipe_updated', 'recipe_deleted')
+
+
+class CostCalculator:
+    def __init__(self, recipes, ingredients):
+        self.unit_costs = {}
+        self.recipes = {}
+        self.recipes_using = {}
+        self.cost_cache = {}
+        for ingredient in ingredients:
+            self.unit_costs[ingredient.name.strip()] = ingredient.cost
+        for recipe in recipes:
+            self.add_recipe(recipe)
+
+    def add_recipe(self, recipe):
+        self.remove_recipe(recipe.name)
+        self.recipes[recipe.name] = recipe
+        # Reverse index so a price change only touches the recipes that use it
+        for ingredient_name in recipe.ingredients:
+            self.recipes_using.setdefault(ingredient_name.strip(), set()).add(recipe.name)
+
+    def remove_recipe(self, recipe_name):
+        recipe = self.recipes.pop(recipe_name, None)
+        if recipe:
+            for ingredient_name in recipe.ingredients:
+                self.recipes_using.get(ingredient_name.strip(), set()).discard(recipe_name)
+        self.cost_cache.pop(recipe_name, None)
+
+    def set_ingredient_cost(self, ingredient_name, cost):
+        ingredient_name = ingredient_name.strip()
+        self.unit_costs[ingredient_name] = cost
+        for recipe_name in self.recipes_using.get(ingredient_name, ()):
+            self.cost_cache.pop(recipe_name, None)
+
+    def on_event(self, event_type, data):
+        if event_type == 'cost_changed':
+            self.set_ingredient_cost(data['name'], data['cost'])
+        elif event_type == 'ingredient_added':
+            self.set_ingredient_cost(data['ingredient']['name'], data['ingredient'].get('cost', 0.0))
+        elif event_type in ('recipe_added', 'recipe_updated'):
+            if event_type == 'recipe_updated':
+                self.remove_recipe(data['old_name'])
+            recipe = data['recipe']
+            self.add_recipe(Recipe(recipe['name'], recipe['category'], recipe['ingredients'], recipe.get('quantities')))
+        elif event_type == 'recipe_deleted':
+            self.remove_recipe(data['name'])
+
+    def attach(self, bus):
+        # Price changes and recipe edits made anywhere in the app only invalidate the recipes they touch
+        for event_type in COSTING_EVENTS:
+            bus.subscribe(event_type, self.on_event)
+
+    def detach(self, bus):
+        for event_type in COSTING_EVENTS:
+            bus.unsubscribe(event_type, self.on_event)
+
+    def recipe_cost(self, recipe_name):
+        cost = self.cost_cache.get(recipe_name)
+        if cost is None:
+            recipe = self.recipes[recipe_name]
+            cost = sum(self.unit_costs.get(name.strip(), 0.0) * recipe.quantity(name) for name in recipe.ingredients)
+            self.cost_cache[recipe_name] = cost
+        return cost
+
+    def recipe_costs(self):
+        return {name: self.recipe_cost(name) for name in self.recipes}
+
+    def item_margin(self, item):
+        # Menu items are costed through the recipe of the same name, if there is one
+        recipe_name = item.get('recipe', item['name'])
+        cost = self.recipe_cost(recipe_name) if recipe_name in self.recipes else None
+        price = item.get('price', 0.0)
+        margin = price - cost if cost is not None else None
+        return {
+            'name': item['name'],
+            'price': price,
+            'cost': cost,
+            'margin': margin,
+            'margin_percent': margin / price * 100 if margin is not None and price else None,
+        }
+
+    def menu_margins(self, menu):
+        return {category: [self.item_margin(item) for item in items] for category, items in menu.items()}
+
+
+#  DATA  VALIDATION
+def is_clean_name(name):
+    return isinstance(name, str) and name != '' and name == name.strip()
+
+def is_amount(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+def validation_issue(section, index, name, code, message, fixable=False):
+    return {'section': section, 'index': index, 'name': name, 'code': code, 'message': message, 'fixable': fixable}
+
+def bad_record(section, index, record):
+    return validation_issue(section, index, None, 'bad_record', f"Record {record!r} is not an object", True)
+
+def check_recipes(start, recipes, inventory_names):
+    issues = []
+    for index, recipe in enumerate(recipes, start):
+        if not isinstance(recipe, dict):
+            issues.append(bad_record('recipes', index, recipe))
+            continue
+        name = recipe.get('name')
+        if not is_clean_name(name):
+            issues.append(validation_issue('recipes', index, name, 'bad_name', "Recipe name must be a non-empty string without surrounding spaces", isinstance(name, str) and name.strip() != ''))
+        if not isinstance(recipe.get('category'), str):
+            issues.append(validation_issue('recipes', index, name, 'bad_category', "Recipe category must be a string"))
+        ingredients = recipe.get('ingredients')
+        if not isinstance(ingredients, list):
+            issues.append(validation_issue('recipes', index, name, 'bad_ingredients', "Recipe ingredients must be a list", isinstance(ingredients, str)))
+            continue
+        for ingredient in ingredients:
+            if not is_clean_name(ingredient):
+                issues.append(validation_issue('recipes', index, name, 'bad_ingredient_name', f"Ingredient {ingredient!r} has surrounding spaces or is empty", isinstance(ingredient, str) and ingredient.strip() != ''))
+            if isinstance(ingredient, str) and ingredient.strip() not in inventory_names:
+                issues.append(validation_issue('recipes', index, name, 'unknown_ingredient', f"Ingredient {ingredient.strip()!r} is not in the inventory"))
+    return issues
+
+def check_inventory(start, inventory, inventory_names):
+    issues = []
+    for index, ingredient in enumerate(inventory, start):
+        if not isinstance(ingredient, dict):
+            issues.append(bad_record('inventory', index, ingredient))
+            continue
+        name = ingredient.get('name')
+        if not is_clean_name(name):
+            issues.append(validation_issue('inventory', index, name, 'bad_name', "Ingredient name must be a non-empty string without surrounding spaces", isinstance(name, str) and name.strip() != ''))
+        stock = ingredient.get('stock')
+        if not isinstance(stock, int) or isinstance(stock, bool):
+            issues.append(validation_issue('inventory', index, name, 'bad_stock', "Stock must be an integer"))
+        elif stock < 0:
+            issues.append(validation_issue('inventory', index, name, 'negative_stock', f"Stock is negative ({stock})", True))
+        cost = ingredient.get('cost', 0.0)
+        if not is_amount(cost) or cost < 0:
+            issues.append(validation_issue('inventory', index, name, 'bad_cost', "Cost must be a non-negative number"))
+    return issues
+
+def check_menu_items(start, category, items, inventory_names):
+    issues = []
+    section = f'menu.{category}'
+    for index, item in enumerate(items, start):
+        if not isinstance(item, dict):
+            issues.append(bad_record(section, index, item))
+            continue
+        name = item.get('name')
+        if not is_clean_name(name):
+            issues.append(validation_issue(section, index, name, 'bad_name', "Menu item name must be a non-empty string without surrounding spaces", isinstance(name, str) and name.strip() != ''))
+        price = item.get('price')
+        if not is_amount(price) or price < 0:
+            issues.append(validation_issue(section, index, name, 'bad_price', "Price must be a non-negative number"))
+        ingredients = item.get('ingredients')
+        if ingredients is None:
+            continue
+        if isinstance(ingredients, str):
+            issues.append(validation_issue(section, index, name, 'free_text_ingredients', "Ingredients should be a list, not free text", True))
+            ingredients = [ingredient.strip() for ingredient in ingredients.split(',') if ingredient.strip()]
+        elif not isinstance(ingredients, list):
+            issues.append(validation_issue(section, index, name, 'bad_ingredients', "Ingredients must be a list"))
+            continue
+        for ingredient in ingredients:
+            if isinstance(ingredient, str) and ingredient.strip() not in inventory_names:
+                issues.append(validation_issue(section, index, name, 'unknown_ingredient', f"Ingredient {ingredient.strip()!r} is not in the inventory"))
+    return issues
+
+# Set once in each worker process by the pool initializer, so the names are not pickled into every job
+worker_inventory_names = frozenset()
+
+def init_check_worker(inventory_names):
+    global worker_inventory_names
+    worker_inventory_names = inventory_names
+
+def run_check(job):
+    check, args = job
+    return check(*args, worker_inventory_names)
+
+
+class CatalogValidator:
+    def __init__(self, max_workers=None, chunk_size=50000, parallel_threshold=100000):
+        self.max_workers = max_workers
+        self.chunk_size = chunk_size
+        self.parallel_threshold = parallel_threshold
+
+    def jobs(self, data):
+        for section, check in (('recipes', check_recipes), ('inventory', check_inventory)):
+            records = data.get(section, [])
+            for start in range(0, len(records), self.chunk_size):
+                yield check, (start, records[start:start + self.chunk_size])
+        for category, items in data.get('menu', {}).items():
+            for start in range(0, len(items), self.chunk_size):
+                yield check_menu_items, (start, category, items[start:start + self.chunk_size])
+
+    def duplicates(self, section, records):
+        issues = []
+        seen = set()
+        for index, record in enumerate(records):
+            if not isinstance(record, dict):
+                continue
+            name = record.get('name')
+            key = name.strip().lower() if isinstance(name, str) else name
+            if key in seen:
+                issues.append(validation_issue(section, index, name, 'duplicate', f"Duplicate name {name!r}", True))
+            else:
+                seen.add(key)
+        return issues
+
+    def validate(self, data):
+        inventory_names = frozenset(item['name'].strip() for item in data.get('inventory', [])
+                                    if isinstance(item, dict) and isinstance(item.get('name'), str))
+        jobs = list(self.jobs(data))
+        record_count = len(data.get('recipes', [])) + len(data.get('inventory', []))
+        record_count += sum(len(items) for items in data.get('menu', {}).values())
+        # Small catalogs are not worth the cost of starting worker processes
+        if record_count >= self.parallel_threshold and len(jobs) > 1:
+            with ProcessPoolExecutor(max_workers=self.max_workers, initializer=init_check_worker,
+                                     initargs=(inventory_names,)) as executor:
+                results = list(executor.map(run_check, jobs))
         else:
+            results = [check(*args, inventory_names) for check, args in jobs]
+
+        issues = [issue for result in results for issue in result]
+        issues += self.duplicates('recipes', data.get('recipes', []))
+        issues += self.duplicates('inventory', data.get('inventory', []))
+        for category, items in data.get('menu', {}).items():
+            issues += self.duplicates(f'menu.{category}', items)
+
+        summary = {}
+        for issue in issues:
+            summary[issue['code']] = summary.get(issue['code'], 0) + 1
+        return {'valid': not issues, 'issue_count': len(issues), 'summary': summary, 'issues': issues}
+
+    def fix(self, data, report):
+        # Repairs what can be repaired without guessing; duplicates keep their first occurrence
+        # and records that are not objects at all are dropped
+        records = {'recipes': data.get('recipes', []), 'inventory': data.get('inventory', [])}
+        for category, items in data.get('menu', {}).items():
+            records[f'menu.{category}'] = items
+
+        removed = {}
+        for issue in report['issues']:
+            if not issue['fixable']:
+                continue
+            record = records[issue['section']][issue['index']]
+            code = issue['code']
+            if code == 'bad_name':
+                record['name'] = record['name'].strip()
+            elif code == 'bad_ingredient_name':
+                # Entries that are not strings are reported but left for a person to sort out
+                record['ingredients'] = [ingredient.strip() if isinstance(ingredient, str) else ingredient
+                                         for ingredient in record['ingredients']
+                                         if not isinstance(ingredient, str) or ingredient.strip()]
+            elif code in ('bad_ingredients', 'free_text_ingredients'):
+                record['ingredients'] = [ingredient.strip() for ingredient in record['ingredients'].split(',') if ingredient.strip()]
+            elif code == 'negative_stock':
+                record['stock'] = 0
+            elif code in ('duplicate', 'bad_record'):
+                removed.setdefault(issue['section'], set()).add(issue['index'])
+
+        for section, indexes in removed.items():
+            kept = [record for index, record in enumerate(records[section]) if index not in indexes]
+            if section.startswith('menu.'):
+                data['menu'][section[len('menu.'):]] = kept
+            else:
+                data[section] = kept
+        return data
+
+    def validate_file(self, filename, fix=False):
+        with open(filename, 'r') as file:
+            data = json.load(file)
+        report = self.validate(data)
+        if fix and report['issue_count']:
+            self.fix(data, report)
+            with open(filename, 'w') as file:
+                json.dump(data, file)
+            report['fixed'] = self.validate(data)
+        return report
+
+
+#  EDIT  SESSIONS
+class Command(ABC):
+    # Which store the command changes: 'menu', 'inventory' or 'recipes'
+    target = None
+
+    @abstractmethod
+    def execute(self):
+        pass
+
+    @abstractmethod
+    def undo(self):
+        pass
+
+class AddMenuItemCommand(Command):
+    target = 'menu'
+
+    def __init__(self, store: PizzaMenuStore, category, name, description, price, ingredients=None):
+        self.store = store
+        self.category = category
+        self.fields = (name, description, price, ingredients)
+
+    def execute(self):
+        name, description, price, ingredients = self.fields
+        self.index = len(self.store.menu.get(self.category, []))
+        if self.category == 'Pizza':
+            self.store.add_pizza_to_menu(name, description, ingredients, price)
+        else:
+            self.store.add_side_dish_to_menu(name, description, price)
+
+    def undo(self):
+        # The menu may have been reloaded since, so find the item again by name
+        items = self.store.menu.get(self.category, [])
+        name = self.fields[0]
+        matches = [index for index, item in enumerate(items) if item['name'] == name]
+        if matches:
+            index = self.index if self.index in matches else matches[-1]
+            del items[index]
+            self.store.publish('menu_item_deleted', {'category': self.category, 'name': name})
+
+class UpdateMenuItemCommand(Command):
+    target = 'menu'
+
+    def __init__(self, store: PizzaMenuStore, category, old_name, name, description, price, ingredients=None):
+        self.store = store
+        self.category = category
+        self.old_name = old_name
+        self.fields = (name, description, price, ingredients)
+
+    def execute(self):
+        name, description, price, ingredients = self.fields
+        item = self.store.get_item_by_name(self.category, self.old_name)
+        self.previous = dict(item) if item else None
+        if self.category == 'Pizza':
+            self.store.update_pizza_in_menu(self.old_name, name, description, ingredients, price)
+        else:
+            self.store.update_side_dish_in_menu(self.old_name, name, description, price)
+
+    def undo(self):
+        if self.previous is None:
+            return
+        # The menu may have been reloaded since, so find the item again by its current name
+        item = self.store.get_item_by_name(self.category, self.fields[0])
+        if item is not None:
+            old_name = item['name']
+            item.clear()
+            item.update(self.previous)
+            self.store.publish('menu_item_updated', {'category': self.category, 'old_name': old_name, 'item': item})
+
+class DeleteMenuItemCommand(Command):
+    target = 'menu'
+
+    def __init__(self, store: PizzaMenuStore, category, name):
+        self.store = store
+        self.category = category
+        self.name = name
+
+    def execute(self):
+        items = self.store.menu.get(self.category, [])
+        self.removed = [(index, item) for index, item in enumerate(items) if item['name'] == self.name]
+        self.store.delete_item_from_menu(self.category, self.name)
+
+    def undo(self):
+        items = self.store.menu.setdefault(self.category, [])
+        for index, item in self.removed:
+            items.insert(index, item)
+            self.store.publish('menu_item_added', {'category': self.category, 'item': item})
+
+class UpdateIngredientCommand(Command):
+    target = 'inventory'
+
+    def __init__(self, manager: InventoryManager, name, stock):
+        self.manager = manager
+        self.name = name
+        self.stock = stock
+
+    def execute(self):
+        self.previous = next((ingredient.stock for ingredient in self.manager.get_inventory() if ingredient.name == self.name), None)
+        self.day = date.today()
+        self.consumed = self.manager.update_ingredient(self.name, self.stock, self.day)
+
+    def undo(self):
+        if self.previous is not None:
+            # Restoring the stock is not a delivery, and the drop it reverts was never consumed
+            self.manager.inventory.update_ingredient(self.name, self.previous)
+            if self.consumed:
+                self.manager.history.record(self.name, -self.consumed, self.day)
+
+class DeleteIngredientCommand(Command):
+    target = 'inventory'
+
+    def __init__(self, manager: InventoryManager, name):
+        self.manager = manager
+        self.name = name
+
+    def execute(self):
+        ingredients = self.manager.get_inventory()
+        self.removed = [(index, ingredient.to_dict()) for index, ingredient in enumerate(ingredients) if ingredient.name == self.name]
+        self.manager.delete_ingredient(self.name)
+
+    def undo(self):
+        # The inventory may have been reloaded since, so restore from the saved fields
+        ingredients = self.manager.get_inventory()
+        if any(ingredient.name == self.name for ingredient in ingredients):
+            return
+        for index, fields in self.removed:
+            ingredient = Ingredient(fields['name'], fields['stock'], fields.get('cost', 0.0))
+            ingredients.insert(index, ingredient)
+            self.manager.inventory.publish('ingredient_added', {'ingredient': ingredient.to_dict()})
+
+# The recipes may have been reloaded since a command ran, so commands find them again by name
+def find_recipe(manager, name):
+    return next((recipe for recipe in manager.get_all_recipes() if recipe.name == name), None)
+
+class AddRecipeCommand(Command):
+    target = 'recipes'
+
+    def __init__(self, manager: RecipeManager, recipe):
+        self.manager = manager
+        self.recipe = recipe
+
+    def execute(self):
+        self.manager.add_recipe(self.recipe)
+
+    def undo(self):
+        recipe = find_recipe(self.manager, self.recipe.name)
+        if recipe is not None:
+            self.manager.delete_recipe(recipe)
+
+class UpdateRecipeCommand(Command):
+    target = 'recipes'
+
+    def __init__(self, manager: RecipeManager, old_recipe, new_recipe):
+        self.manager = manager
+        self.old_recipe = old_recipe
+        self.new_recipe = new_recipe
+
+    def execute(self):
+        recipe = find_recipe(self.manager, self.old_recipe.name)
+        self.applied = recipe is not None
+        if self.applied:
+            self.manager.update_recipe(recipe, self.new_recipe)
+
+    def undo(self):
+        recipe = find_recipe(self.manager, self.new_recipe.name)
+        if self.applied and recipe is not None:
+            self.manager.update_recipe(recipe, self.old_recipe)
+
+class DeleteRecipeCommand(Command):
+    target = 'recipes'
+
+    def __init__(self, manager: RecipeManager, recipe):
+        self.manager = manager
+        self.recipe = recipe
+
+    def execute(self):
+        recipe = find_recipe(self.manager, self.recipe.name)
+        self.index = None
+        if recipe is not None:
+            self.index = self.manager.get_all_recipes().index(recipe)
+            self.removed = recipe
+            self.manager.delete_recipe(recipe)
+
+    def undo(self):
+        if self.index is not None and find_recipe(self.manager, self.recipe.name) is None:
+            self.manager.add_recipe(self.removed, min(self.index, len(self.manager.get_all_recipes())))
+
+class CommandGroup(Command):
+    def __init__(self, commands):
+        self.commands = commands
+
+    @property
+    def targets(self):
+        return {command.target for command in self.commands}
+
+    def execute(self):
+        for command in self.commands:
+            command.execute()
+
+    def undo(self):
+        for command in reversed(self.commands):
+            command.undo()
+
+
+class EditSession:
+    def __init__(self, menu_store: PizzaMenuStore = None, inventory_manager: InventoryManager = None,
+                 recipe_manager: RecipeManager = None, data_file='data.json'):
+        self.menu_store = menu_store
+        self.inventory_manager = inventory_manager
+        self.recipe_manager = recipe_manager
+        self.data_file = data_file
+        self.undo_stack = []
+        self.redo_stack = []
+        self.pending = None
+        # The session writes once per action or transaction instead of once per edit
+        if menu_store:
+            menu_store.autosave = False
+
+    def save(self, targets):
+        if 'menu' in targets and self.menu_store:
+            self.menu_store.write_data()
+        if 'inventory' in targets and self.inventory_manager:
+            self.inventory_manager.save_inventory_to_json(self.data_file)
+        if 'recipes' in targets and self.recipe_manager:
+            self.recipe_manager.save_to_file(self.data_file)
+
+    def targets(self, command):
+        return command.targets if isinstance(command, CommandGroup) else {command.target}
+
+    def execute(self, command: Command):
+        if self.pending is not None:
+            command.execute()
+            self.pending.append(command)
+            return
+        command.execute()
+        self.undo_stack.append(command)
+        self.redo_stack.clear()
+        self.save(self.targets(command))
+
+    @contextmanager
+    def transaction(self):
+        if self.pending is not None:
+            # Nested transactions join the outer one
+            yield self
+            return
+        self.pending = []
+        try:
+            yield self
+        except Exception:
+            commands, self.pending = self.pending, None
+            CommandGroup(commands).undo()
+            raise
+        commands, self.pending = self.pending, None
+        if commands:
+            group = CommandGroup(commands)
+            self.undo_stack.append(group)
+            self.redo_stack.clear()
+            self.save(group.targets)
+
+    def can_undo(self):
+        return bool(self.undo_stack)
+
+    def can_redo(self):
+        return bool(self.redo_stack)
+
+    # A command leaves its stack only once it has run, so a failed undo or redo can be retried
+    def undo(self):
+        if self.undo_stack:
+            command = self.undo_stack[-1]
+            command.undo()
+            self.redo_stack.append(self.undo_stack.pop())
+            self.save(self.targets(command))
+
+    def redo(self):
+        if self.redo_stack:
+            command = self.redo_stack[-1]
+            command.execute()
+            self.undo_stack.append(self.redo_stack.pop())
+            self.save(self.targets(command))
+
+
+#  FACETED  BROWSING
+PRICE_BANDS = (5.0, 10.0, 15.0)
+
+def price_band(price, bands=PRICE_BANDS):
+    lower = 0
+    for upper in bands:
+        if price < upper:
+            return f'{lower:g}-{upper:g}'
+        lower = upper
+    return f'{lower:g}+'
+
+def slots_bitmap(slots, size):
+    # Sets the bits in a byte buffer and converts once, OR-ing into a growing int would copy it per slot
+    bits = bytearray((size + 7) // 8)
+    for slot in slots:
+        bits[slot >> 3] |= 1 << (slot & 7)
+    return int.from_bytes(bits, 'little')
+
+def bitmap_slots(bitmap):
+    # Lowest slot first, from a single scan of the binary digits
+    digits = bin(bitmap)[:1:-1]
+    slot = digits.find('1')
+    while slot != -1:
+        yield slot
+        slot = digits.find('1', slot + 1)
+
+
+class FacetIndex:
+    def __init__(self, facet_function):
+        self.facet_function = facet_function
+        self.records = []
+        self.slots = {}
+        # (facet, value) -> bitmap of record slots, plus the matching counts
+        self.bitmaps = {}
+        self.totals = {}
+        self.live = 0
+
+    def rebuild(self, records):
+        self.records = list(records)
+        self.slots = {id(record): slot for slot, record in enumerate(self.records)}
+        facet_slots = {}
+        for slot, record in enumerate(self.records):
+            for facet, values in self.facet_function(record).items():
+                for value in values:
+                    facet_slots.setdefault((facet, value), []).append(slot)
+        self.bitmaps = {key: slots_bitmap(slots, len(self.records)) for key, slots in facet_slots.items()}
+        self.totals = {key: len(slots) for key, slots in facet_slots.items()}
+        self.live = (1 << len(self.records)) - 1
+
+    def add(self, record):
+        slot = len(self.records)
+        self.records.append(None)
+        self.fill(slot, record)
+        return slot
+
+    def fill(self, slot, record):
+        self.records[slot] = record
+        self.slots[id(record)] = slot
+        self.live |= 1 << slot
+        for facet, values in self.facet_function(record).items():
+            for value in values:
+                key = (facet, value)
+                self.bitmaps[key] = self.bitmaps.get(key, 0) | (1 << slot)
+                self.totals[key] = self.totals.get(key, 0) + 1
+
+    def clear(self, slot):
+        bit = 1 << slot
+        self.slots.pop(id(self.records[slot]), None)
+        self.records[slot] = None
+        self.live &= ~bit
+        for key, bitmap in self.bitmaps.items():
+            if bitmap & bit:
+                self.bitmaps[key] = bitmap & ~bit
+                self.totals[key] -= 1
+
+    def remove(self, record):
+        slot = self.slots.get(id(record))
+        if slot is None:
+            return
+        self.clear(slot)
+        # Compact once half the slots are empty so the records and bitmaps stop growing
+        if len(self.records) > 2 * len(self.slots) + 32:
+            self.rebuild([record for record in self.records if record is not None])
+
+    def replace(self, old_record, new_record):
+        # The new record takes over the old slot, so it keeps its place in the results
+        slot = self.slots.get(id(old_record))
+        if slot is None:
+            return self.add(new_record)
+        self.clear(slot)
+        self.fill(slot, new_record)
+        return slot
+
+    def match(self, selection=None, exclude=None):
+        # Values within a facet are OR'ed, facets are AND'ed together
+        result = self.live
+        for facet, values in (selection or {}).items():
+            matched = 0
+            for value in values:
+                matched |= self.bitmaps.get((facet, value), 0)
+            result &= matched
+        for facet, values in (exclude or {}).items():
+            for value in values:
+                result &= ~self.bitmaps.get((facet, value), 0)
+        return result
+
+    def filter(self, selection=None, exclude=None):
+        return [self.records[slot] for slot in bitmap_slots(self.match(selection, exclude))]
+
+    def counts(self, selection=None, exclude=None):
+        counts = {}
+        if not selection and not exclude:
+            for (facet, value), total in self.totals.items():
+                if total:
+                    counts.setdefault(facet, {})[value] = total
+            return counts
+        bitmap = self.match(selection, exclude)
+        for (facet, value), values in self.bitmaps.items():
+            total = (values & bitmap).bit_count()
+            if total:
+                counts.setdefault(facet, {})[value] = total
+        return counts
+
+
+#  DIETARY  CONSTRAINTS
+ALLERGENS = ('dairy', 'gluten', 'nuts', 'egg', 'fish', 'soy')
+ALLERGEN_BITS = {allergen: 1 << index for index, allergen in enumerate(ALLERGENS)}
+NOT_VEGETARIAN = 1 << len(ALLERGENS)
+NOT_VEGAN = 1 << (len(ALLERGENS) + 1)
+DIET_BITS = {'vegetarian': NOT_VEGETARIAN, 'vegan': NOT_VEGAN, 'gluten_free': ALLERGEN_BITS['gluten']}
+# Keyword rules for ingredients that have no entry in the attribute table
+INGREDIENT_TAGS = {
+    'meat': ['pepperoni', 'sausage', 'bacon', 'beef', 'ham', 'chicken', 'salami', 'meatball'],
+    'fish': ['anchov', 'tuna', 'salmon', 'shrimp', 'prawn'],
+    'dairy': ['cheese', 'mozzarella', 'mozarella', 'ricotta', 'parmesan', 'gorgonzola', 'alfredo', 'cream', 'butter'],
+    'gluten': ['bread', 'crust', 'dough', 'pasta', 'flour'],
+    'egg': ['egg'],
+    'nuts': ['pesto', 'nut', 'almond'],
+    'soy': ['soy', 'tofu', 'tempeh', 'edamame'],
+}
+
+def ingredient_tags(ingredient_name):
+    name = ingredient_name.strip().lower()
+    return {tag for tag, keywords in INGREDIENT_TAGS.items() if any(keyword in name for keyword in keywords)}
+
+def profile_mask(diets=(), allergens=()):
+    mask = 0
+    for diet in diets:
+        mask |= DIET_BITS[diet]
+    for allergen in allergens:
+        mask |= ALLERGEN_BITS[allergen]
+    return mask
+
+def describe_mask(mask):
+    labels = [allergen for allergen, bit in ALLERGEN_BITS.items() if mask & bit]
+    if mask & NOT_VEGETARIAN:
+        labels.append('not vegetarian')
+    elif mask & NOT_VEGAN:
+        labels.append('not vegan')
+    return labels
+
+
+class DietaryEngine:
+    def __init__(self, attributes: IngredientAttributes = None, recipes=()):
+        self.attributes = attributes or IngredientAttributes()
+        self.recipes = {recipe.name: recipe for recipe in recipes}
+        self.ingredient_masks = {}
+        self.item_masks = {}
+
+    def ingredient_mask(self, ingredient_name):
+        name = ingredient_name.strip()
+        mask = self.ingredient_masks.get(name)
+        if mask is None:
+            attributes = self.attributes.get(name)
+            if attributes is None:
+                # Fall back to the keyword rules for ingredients without attributes
+                tags = ingredient_tags(name)
+                attributes = {'allergens': tags & set(ALLERGENS),
+                              'vegetarian': not tags & {'meat', 'fish'},
+                              'vegan': not tags & {'meat', 'fish', 'dairy', 'egg'}}
+            mask = 0
+            for allergen in attributes.get('allergens', ()):
+                mask |= ALLERGEN_BITS.get(allergen, 0)
+            if not attributes.get('vegetarian', True):
+                mask |= NOT_VEGETARIAN | NOT_VEGAN
+            elif not attributes.get('vegan', True):
+                mask |= NOT_VEGAN
+            self.ingredient_masks[name] = mask
+        return mask
+
+    def ingredients_mask(self, ingredients):
+        if isinstance(ingredients, str):
+            ingredients = ingredients.split(',')
+        mask = 0
+        for ingredient in ingredients:
+            mask |= self.ingredient_mask(ingredient)
+        return mask
+
+    def item_ingredients(self, item):
+        ingredients = item.get('ingredients')
+        if ingredients:
+            return ingredients
+        if item['name'] in self.recipes:
+            return self.recipes[item['name']].ingredients
+        # Side dishes list no ingredients, so judge them by their name
+        return [item['name']]
+
+    def item_mask(self, item):
+        key = (item['name'], str(item.get('ingredients')))
+        mask = self.item_masks.get(key)
+        if mask is None:
+            mask = self.item_masks[key] = self.ingredients_mask(self.item_ingredients(item))
+        return mask
+
+    def recipe_mask(self, recipe):
+        return self.ingredients_mask(recipe.ingredients or [])
+
+    def load_attributes(self, filename):
+        self.attributes.load_from_json(filename)
+        self.ingredient_masks = {}
+        self.item_masks = {}
+
+    def set_attributes(self, ingredient_name, **attributes):
+        self.attributes.set(ingredient_name, **attributes)
+        self.ingredient_masks.pop(ingredient_name.strip(), None)
+        self.item_masks = {}
+
+    def allows(self, mask, profile):
+        return not mask & profile
+
+    def filter_menu(self, menu, profile):
+        return {category: [item for item in items if not self.item_mask(item) & profile] for category, items in menu.items()}
+
+    def order_warnings(self, order, profile=0, menu=None):
+        # Order lines for menu items carry no ingredients, so look them up on the menu
+        menu_items = {item['name']: item for items in (menu or {}).values() for item in items}
+        warnings = []
+        for item in order.get_items():
+            mask = self.item_mask(item if item.get('ingredients') else menu_items.get(item['name'], item))
+            conflicts = mask & profile
+            if conflicts:
+                warnings.append(f"{item['name']} is not suitable: {', '.join(describe_mask(conflicts))}")
+            elif mask & ~(NOT_VEGETARIAN | NOT_VEGAN):
+                warnings.append(f"{item['name']} contains {', '.join(describe_mask(mask & ~(NOT_VEGETARIAN | NOT_VEGAN)))}")
+        return warnings
+
+    def record_facets(self, record):
+        # Facet function for FacetIndex, works for Recipe objects and menu item dicts alike
+        if isinstance(record, dict):
+            category, price, mask = record.get('category'), record.get('price'), self.item_mask(record)
+        else:
+            category, price, mask = record.category, None, self.recipe_mask(record)
+        facets = {'allergen': {allergen for allergen, bit in ALLERGEN_BITS.items() if mask & bit},
+                  'diet': {diet for diet, bit in DIET_BITS.items() if not mask & bit}}
+        if category is not None:
+            facets['category'] = {category}
+        if price is not None:
+            facets['price_band'] = {price_band(price)}
+        return facets
+
+
+#  TICKETS
+RECEIPT_TEMPLATE = Template("""PIZZA STORE
+Order #$order_number    $timestamp
+$rule
+$lines
+$rule
+TOTAL${total}
+$fulfillment
+""")
+KITCHEN_TEMPLATE = Template("""KITCHEN  #$order_number
+$timestamp    $fulfillment
+$rule
+$lines
+$rule
+""")
+ESC_POS_INIT = b'\x1b@'
+ESC_POS_BOLD_ON = b'\x1bE\x01'
+ESC_POS_BOLD_OFF = b'\x1bE\x00'
+ESC_POS_CUT = b'\n\n\n\x1dV\x00'
+
+
+class TicketRenderer:
+    def __init__(self, width=32, receipt_template=RECEIPT_TEMPLATE, kitchen_template=KITCHEN_TEMPLATE):
+        self.width = width
+        self.receipt_template = receipt_template
+        self.kitchen_template = kitchen_template
+
+    def receipt_lines(self, order):
+        for item in order.get_items():
+            price = f"${item['total_price']:.2f}"
+            label = f"{item['quantity']} x {item['name']}"[:self.width - len(price) - 1]
+            yield f"{label:<{self.width - len(price)}}{price}"
+            if item.get("ingredients"):
+                yield f"    {', '.join(item['ingredients'])}"[:self.width]
+
+    def kitchen_lines(self, order):
+        for item in order.get_items():
+            yield f"{item['quantity']} x {item['name'].upper()}"
+            for ingredient in item.get("ingredients") or []:
+                yield f"   + {ingredient}"
+
+    def fulfillment_text(self, order):
+        if not order.fulfillment:
+            return ''
+        return f"{order.fulfillment['kind'].upper()} {time.strftime('%H:%M', time.localtime(order.fulfillment['start']))}"
+
+    def render_receipt(self, order, order_number=0, timestamp=None):
+        total = f"${order.get_total():.2f}"
+        return self.receipt_template.substitute(
+            order_number=order_number,
+            timestamp=timestamp or time.strftime('%Y-%m-%d %H:%M'),
+            rule='-' * self.width,
+            lines='\n'.join(self.receipt_lines(order)),
+            total=total.rjust(self.width - len('TOTAL')),
+            fulfillment=self.fulfillment_text(order),
+        )
+
+    def render_kitchen_ticket(self, order, order_number=0, timestamp=None):
+        return self.kitchen_template.substitute(
+            order_number=order_number,
+            timestamp=timestamp or time.strftime('%H:%M:%S'),
+            rule='=' * self.width,
+            lines='\n'.join(self.kitchen_lines(order)),
+            fulfillment=self.fulfillment_text(order),
+        )
+
+    def to_escpos(self, text):
+        # First line is printed bold as the header, the rest as plain text, then the paper is cut
+        header, _, body = text.partition('\n')
+        return (ESC_POS_INIT + ESC_POS_BOLD_ON + header.encode('cp437', 'replace') + b'\n' + ESC_POS_BOLD_OFF
+                + body.encode('cp437', 'replace') + ESC_POS_CUT)
+
+    def render_batch(self, jobs):
+        # jobs: (order, order_number) pairs -> {file name: content}
+        timestamp = time.strftime('%Y-%m-%d %H:%M')
+        tickets = {}
+        for order, order_number in jobs:
+            receipt = self.render_receipt(order, order_number, timestamp)
+            kitchen = self.render_kitchen_ticket(order, order_number, timestamp)
+            tickets[f'{order_number:06d}-receipt.txt'] = receipt
+            tickets[f'{order_number:06d}-receipt.bin'] = self.to_escpos(receipt)
+            tickets[f'{order_number:06d}-kitchen.txt'] = kitchen
+            tickets[f'{order_number:06d}-kitchen.bin'] = self.to_escpos(kitchen)
+        return tickets
+
+
+MAX_ERRORS = 100
+
+
+class TicketPipeline:
+    def __init__(self, renderer: TicketRenderer = None, spool: TicketSpool = None, batch_size=50):
+        self.renderer = renderer or TicketRenderer()
+        self.spool = spool or TicketSpool()
+        self.batch_size = batch_size
+        self.jobs = queue.Queue()
+        self.order_number = self.spool.last_ticket_number()
+        self.errors = []
+        # Rendering and writing happen on a background thread so the till never waits on them
+        self.worker = threading.Thread(target=self.run, daemon=True)
+        self.worker.start()
+
+    def submit(self, order):
+        self.order_number += 1
+        self.jobs.put((order, self.order_number))
+        return self.order_number
+
+    def run(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                break
+            batch = [job]
+            while len(batch) < self.batch_size:
+                try:
+                    job = self.jobs.get_nowait()
+                except queue.Empty:
+                    break
+                if job is None:
+                    self.jobs.put(None)
+                    break
+                batch.append(job)
+            try:
+                tickets = self.renderer.render_batch(batch)
+            except Exception:
+                # Render the orders one by one so a failing order only loses its own tickets
+                self.render_each(batch)
+            else:
+                self.write(tickets, batch)
+
+    def render_each(self, batch):
+        for job in batch:
+            try:
+                tickets = self.renderer.render_batch([job])
+            except Exception as error:
+                self.record_error(job, error)
+            else:
+                self.write(tickets, [job])
+
+    def write(self, tickets, batch):
+        try:
+            for name, content in tickets.items():
+                self.spool.write(name, content)
+        except Exception as error:
+            for job in batch:
+                self.record_error(job, error)
+
+    def record_error(self, job, error):
+        # Recorded and skipped, the worker keeps serving the queue
+        logger.error("Could not print the tickets for order %s", job[1], exc_info=error)
+        self.errors.append((job[1], error))
+        del self.errors[:-MAX_ERRORS]
+
+    def close(self):
+        self.jobs.put(None)
+        self.worker.join()
+
+
+#  MENU  VIEW  CACHE
+class MenuViewModel:
+    def __init__(self, version, menu, ingredients, dietary_engine):
+        self.version = version
+        self.menu = menu
+        self.inventory = [{"name": ingredient.name, "stock": ingredient.stock} for ingredient in ingredients]
+        self.dietary_engine = dietary_engine
+        self.items = {}
+        self.groups = []
+        self.filtered = {}
+        # Category, allergen, diet and price band facets over the menu rows
+        self.facets = FacetIndex(lambda row: dietary_engine.record_facets(dict(row['item'], category=row['category'])))
+
+        stock = {ingredient.name.strip(): ingredient.stock for ingredient in ingredients}
+        for category, items in menu.items():
+            rows = []
+            for item in items:
+                ingredients = item.get('ingredients') or []
+                if isinstance(ingredients, str):
+                    ingredients = ingredients.split(',')
+                rows.append({
+                    'category': category,
+                    'name': item['name'],
+                    'description': item.get('description', ''),
+                    'price': item.get('price', 0.0),
+                    'price_text': f"${item.get('price', 0.0):.2f}",
+                    # Ingredients the store does not track never make an item unavailable
+                    'available': all(stock.get(ingredient.strip(), 1) > 0 for ingredient in ingredients),
+                    'item': item,
+                })
+                self.items[item['name']] = item
+            self.groups.append((category, rows))
+        self.facets.rebuild(row for category, rows in self.groups for row in rows)
+
+    def groups_for(self, profile=0, selection=None):
+        if not profile and not selection:
+            return self.groups
+        key = (profile, tuple(sorted((facet, tuple(sorted(values))) for facet, values in (selection or {}).items())))
+        groups = self.filtered.get(key)
+        if groups is None:
+            matched = {id(row) for row in self.facets.filter(selection)} if selection else None
+            groups = self.filtered[key] = [
+                (category, [row for row in rows if (matched is None or id(row) in matched)
+                            and not self.dietary_engine.item_mask(row['item']) & profile])
+                for category, rows in self.groups
+            ]
+        return groups
+
+    def facet_counts(self, selection=None):
+        return self.facets.counts(selection)
+
+    def find_item(self, name):
+        return self.items.get(name)
+
+
+class MenuViewCache:
+    def __init__(self):
+        self.versions = {}
+        self.views = {}
+        self.lock = threading.Lock()
+
+    def invalidate(self, menu_file):
+        with self.lock:
+            self.versions[menu_file] = self.versions.get(menu_file, 0) + 1
+
+    def file_stamp(self, filename):
+        try:
+            return os.stat(filename).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def get(self, router: StoreRouter):
+        store_file = router.store_file()
+        # Edits saved by other processes show up through the file timestamps
+        version = (self.versions.get(store_file, 0), self.file_stamp(router.catalog_file), self.file_stamp(store_file))
+        view = self.views.get(store_file)
+        if view is not None and view.version == version:
+            return view
+
+        with self.lock:
+            view = self.views.get(store_file)
+            if view is None or view.version != version:
+                recipe_store = PizzaStore()
+                recipe_store.load_from_file(router.catalog_file)
+                attributes = IngredientAttributes()
+                attributes.load_from_json(router.catalog_file)
+                dietary_engine = DietaryEngine(attributes, recipe_store.get_all_recipes())
+                view = MenuViewModel(version, router.load_menu(), router.load_inventory().get_ingredients(), dietary_engine)
+                self.views[store_file] = view
+        return view
+
+
+menu_view_cache = MenuViewCache()
+
+
+#  SYNC
+RECIPE_FIELDS = ('category', 'ingredients', 'quantities')
+MENU_FIELDS = ('description', 'ingredients', 'price')
+# Stock, costs and menus belong to one store, recipes are shared by the whole chain
+STORE_EVENTS = ('stock_changed', 'ingredient_added', 'ingredient_deleted', 'cost_changed',
+                'menu_item_added', 'menu_item_updated', 'menu_item_deleted', 'slot_booked', 'slot_released')
+# Clock key suffix for when a record was deleted, older adds and edits of it are dropped
+TOMBSTONE = 'deleted'
+
+
+def is_change_record(record):
+    return (isinstance(record, dict) and isinstance(record.get('time'), (int, float)) and isinstance(record.get('seq'), int)
+            and isinstance(record.get('origin') or '', str) and isinstance(record.get('event'), str)
+            and isinstance(record.get('data'), dict))
+
+def change_order(entry):
+    record = entry[2]
+    if not is_change_record(record):
+        return (0, '', 0)
+    return (record['time'], record['origin'] or '', record['seq'])
+
+
+def local_node_id(router: StoreRouter):
+    # Every till needs a log of its own, even when it shares a store or a host with another,
+    # so the id is made up once and kept next to the till's data file
+    node_file = os.path.splitext(router.store_file())[0] + '.node'
+    try:
+        with open(node_file, 'r') as file:
+            node_id = file.read().strip()
+        if node_id:
+            return node_id
+    except FileNotFoundError:
+        pass
+    node_id = f"{router.active_store or 'chain'}-{socket.gethostname()}-{uuid.uuid4().hex[:8]}"
+    with open(node_file, 'w') as file:
+        file.write(node_id)
+    return node_id
+
+
+class SyncEngine:
+    # Tills exchange their change logs through a shared folder: every node appends to
+    # <sync_dir>/<node_id>.log and reads the other logs from where it last stopped.
+    def __init__(self, sync_dir, router: StoreRouter, node_id=None):
+        self.node_id = node_id or local_node_id(router)
+        self.sync_dir = sync_dir
+        self.router = router
+        os.makedirs(sync_dir, exist_ok=True)
+        self.change_log = ChangeLog(os.path.join(sync_dir, f'{self.node_id}.log'), origin=self.node_id)
+        self.state_file = os.path.join(sync_dir, f'{self.node_id}.state')
+        self.cursors = {}
+        # (entity, field) -> (time, origin) of the last write that won
+        self.clocks = {}
+        # pull() runs on a worker thread while local edits record their clocks on the UI thread
+        self.lock = threading.Lock()
+        self.applying = False
+        # Copies held by open windows and the kitchen's slot scheduler
+        self.live = {'recipes': [], 'inventory': [], 'menu': [], 'scheduler': []}
+        self.load_state()
+
+    def attach(self, bus):
+        self.change_log.attach(bus)
+        bus.subscribe('*', self.record_local)
+
+    def live_kind(self, copy):
+        if isinstance(copy, (RecipeManager, PizzaStore)):
+            return 'recipes'
+        if isinstance(copy, AbstractInventory):
+            return 'inventory'
+        if isinstance(copy, SlotScheduler):
+            return 'scheduler'
+        return 'menu'
+
+    def track(self, copy):
+        # Incoming changes are applied to tracked copies too, so a window saving its copy keeps them
+        self.live[self.live_kind(copy)].append(copy)
+
+    def untrack(self, copy):
+        copies = self.live[self.live_kind(copy)]
+        if copy in copies:
+            copies.remove(copy)
+
+    def load_state(self):
+        try:
+            with open(self.state_file, 'r') as file:
+                state = json.load(file)
+        except FileNotFoundError:
+            return
+        self.cursors = state.get('cursors', {})
+        self.clocks = {tuple(json.loads(key)): tuple(value) for key, value in state.get('clocks', {}).items()}
+
+    def save_state(self):
+        with self.lock:
+            state = {'cursors': dict(self.cursors),
+                     'clocks': {json.dumps(list(key)): list(value) for key, value in self.clocks.items()}}
+        with open(self.state_file + '.tmp', 'w') as file:
+            json.dump(state, file)
+        os.replace(self.state_file + '.tmp', self.state_file)
+
+    def entity_fields(self, event_type, data):
+        if event_type in ('recipe_added', 'recipe_updated'):
+            return ('recipe', data['recipe']['name']), RECIPE_FIELDS
+        if event_type in ('menu_item_added', 'menu_item_updated'):
+            return ('menu', data['category'], data['item']['name']), MENU_FIELDS
+        if event_type == 'cost_changed':
+            return ('ingredient', data['name']), ('cost',)
+        return None, ()
+
+    def deleted_entity(self, event_type, data):
+        if event_type == 'recipe_deleted':
+            return ('recipe', data['name']), RECIPE_FIELDS
+        if event_type == 'menu_item_deleted':
+            return ('menu', data['category'], data['name']), MENU_FIELDS
+        return None, ()
+
+    def clock(self, key):
+        return tuple(self.clocks.get(key, (0, '')))
+
+    def record_local(self, event_type, data):
+        if self.applying:
+            return
+        entity, fields = self.entity_fields(event_type, data)
+        deleted, _ = self.deleted_entity(event_type, data)
+        clock = (time.time(), self.node_id)
+        with self.lock:
+            for field in fields:
+                self.clocks[entity + (field,)] = clock
+            if deleted is not None:
+                self.clocks[deleted + (TOMBSTONE,)] = clock
+
+    def wins(self, key, clock):
+        # Last writer wins, ties broken by node id so every till picks the same winner
+        if clock > self.clock(key):
+            self.clocks[key] = clock
+            return True
+        return False
+
+    def incoming(self):
+        for name in sorted(os.listdir(self.sync_dir)):
+            peer, extension = os.path.splitext(name)
+            if extension != '.log' or peer == self.node_id:
+                continue
+            for offset, record in read_log(os.path.join(self.sync_dir, name), self.cursors.get(peer, 0)):
+                yield peer, offset, record
+
+    def pull(self):
+        # Reads the other logs and rewrites the data files, safe to run on a worker thread.
+        # Returns the changes that won, each with the events it raised, for deliver().
+        records = list(self.incoming())
+        if not records:
+            return []
+
+        recipe_store = PizzaStore()
+        recipe_store.load_from_file(self.router.catalog_file)
+        inventory = self.router.load_inventory()
+        menu_store = PizzaMenuStore(self.router.menu_handler())
+        menu_store.load_data()
+        menu_store.autosave = False
+
+        records.sort(key=change_order)
+        changes = []
+        for peer, offset, record in records:
+            # A bad record is logged and skipped, it must not hold up the ones after it
+            try:
+                if not is_change_record(record):
+                    raise ValueError(f"Not a change record: {record!r}")
+                with self.lock:
+                    change = self.resolve(record)
+                if change is not None:
+                    with event_bus.hold() as events:
+                        self.apply(change, [recipe_store], [inventory], [menu_store], [])
+                    changes.append((change, events))
+            except Exception:
+                logger.exception("Skipping the change from %s before offset %s", peer, offset)
+            self.cursors[peer] = max(self.cursors.get(peer, 0), offset)
+
+        # One write per store for the whole batch of changes
+        recipe_store.save_to_file(self.router.catalog_file)
+        inventory.save_to_json(self.router.store_file())
+        menu_store.write_data()
+        self.save_state()
+        return changes
+
+    def deliver(self, changes):
+        # On the UI thread: open windows get each change quietly, then its events are announced once
+        self.applying = True
+        self.change_log.paused = True
+        try:
+            for change, events in changes:
+                try:
+                    with event_bus.mute():
+                        self.apply(change, self.live['recipes'], self.live['inventory'], self.live['menu'], self.live['scheduler'])
+                except Exception:
+                    logger.exception("Could not apply a synced %s to the open windows", change[0])
+                for event_type, data in events:
+                    event_bus.publish(event_type, data)
+        finally:
+            self.applying = False
+            self.change_log.paused = False
+
+    def sync(self):
+        changes = self.pull()
+        self.deliver(changes)
+        return len(changes)
+
+    def resolve(self, record):
+        # Decides once per record what wins, so every copy it is applied to ends up the same
+        event_type, data = record['event'], record['data']
+        if event_type in STORE_EVENTS and data.get('store') != self.router.active_store:
+            return None
+        clock = (record['time'], record['origin'] or '')
+        deleted, fields = self.deleted_entity(event_type, data)
+        if deleted is not None:
+            # A delete loses to any newer edit of the same record
+            if all(clock >= self.clock(deleted + (field,)) for field in fields):
+                self.wins(deleted + (TOMBSTONE,), clock)
+                return event_type, data, []
             return None
+        entity, fields = self.entity_fields(event_type, data)
+        if entity is not None and clock < self.clock(entity + (TOMBSTONE,)):
+            return None  # Made before the record was deleted
+        return event_type, data, [field for field in fields if self.wins(entity + (field,), clock)]
 
+    def apply(self, change, recipe_managers, inventories, menu_stores, schedulers):
+        event_type, data, won = change
+        if event_type in ('recipe_added', 'recipe_updated'):
+            name = data['recipe']['name']
+            for recipe_manager in recipe_managers:
+                current = next((recipe for recipe in recipe_manager.get_all_recipes() if recipe.name in (name, data.get('old_name'))), None)
+                merged = current.to_dict() if current else {'name': name, 'category': '', 'ingredients': []}
+                merged['name'] = name
+                for field in won:
+                    if field in data['recipe']:
+                        merged[field] = data['recipe'][field]
+                recipe = Recipe(merged['name'], merged['category'], merged['ingredients'], merged.get('quantities'))
+                if current:
+                    recipe_manager.update_recipe(current, recipe)
+                else:
+                    recipe_manager.add_recipe(recipe)
+        elif event_type == 'recipe_deleted':
+            for recipe_manager in recipe_managers:
+                for recipe in [recipe for recipe in recipe_manager.get_all_recipes() if recipe.name == data['name']]:
+                    recipe_manager.delete_recipe(recipe)
+        elif event_type in ('menu_item_added', 'menu_item_updated'):
+            category, item = data['category'], data['item']
+            for menu_store in menu_stores:
+                current = menu_store.get_item_by_name(category, data.get('old_name') or item['name'])
+                merged = dict(current) if current else {'name': item['name'], 'description': '', 'price': 0.0}
+                for field in won:
+                    if field in item:
+                        merged[field] = item[field]
+                if current:
+                    current.clear()
+                    current.update(merged, name=item['name'])
+                else:
+                    menu_store.menu.setdefault(category, []).append(merged)
+        elif event_type == 'menu_item_deleted':
+            for menu_store in menu_stores:
+                menu_store.delete_item_from_menu(data['category'], data['name'])
+        elif event_type == 'stock_changed':
+            # Stock is a counter: apply the other till's change rather than its final value
+            delta = data['stock'] - data['old_stock']
+            for inventory in inventories:
+                for ingredient in inventory.get_ingredients():
+                    if ingredient.name == data['name']:
+                        inventory.update_ingredient(ingredient.name, ingredient.stock + delta)
+                        break
+        elif event_type == 'ingredient_added':
+            added = data['ingredient']
+            for inventory in inventories:
+                existing = next((ingredient for ingredient in inventory.get_ingredients() if ingredient.name == added['name']), None)
+                if existing:
+                    inventory.update_ingredient(existing.name, existing.stock + added['stock'])
+                else:
+                    inventory.add_ingredient(Ingredient(added['name'], added['stock'], added.get('cost', 0.0)))
+        elif event_type == 'ingredient_deleted':
+            for inventory in inventories:
+                inventory.delete_ingredient(data['name'])
+        elif event_type == 'cost_changed':
+            if won:
+                for inventory in inventories:
+                    inventory.update_ingredient_cost(data['name'], data['cost'])
+        elif event_type in ('slot_booked', 'slot_released'):
+            # Bookings are counters like stock, each till adds the others' bookings to its own
+            for scheduler in schedulers:
+                scheduler.apply_booking(event_type, data)
+
+
+#  SCHEDULING
+SCHEDULING_EVENTS = ('recipe_added', 'recipe_updated', 'recipe_deleted', 'menu_item_added', 'menu_item_updated', 'menu_item_deleted')
+
+
+class SlotScheduler:
+    def __init__(self, recipes=(), menu=None, slot_minutes=15, ovens=2, oven_capacity=4, bake_minutes=8, staff=2,
+                 base_prep_minutes=2.0, prep_minutes_per_ingredient=0.5, side_prep_minutes=1.0, horizon_days=7,
+                 store_id=None, bookings_file=None):
+        self.slot_seconds = slot_minutes * 60
+        self.slots_per_day = 24 * 60 // slot_minutes
+        self.horizon_slots = horizon_days * self.slots_per_day
+        # Oven throughput and kitchen staff time available in one slot
+        self.pizza_capacity = ovens * oven_capacity * max(1, slot_minutes // bake_minutes)
+        self.prep_capacity = staff * slot_minutes
+        self.base_prep_minutes = base_prep_minutes
+        self.prep_minutes_per_ingredient = prep_minutes_per_ingredient
+        self.side_prep_minutes = side_prep_minutes
+        self.recipes = {recipe.name: recipe for recipe in recipes}
+        self.pizza_names = {item['name'] for item in (menu or {}).get('Pizza', [])}
+        # slot index -> [pizzas, prep minutes] booked, and per day a bitmap of slots that are full
+        self.used = {}
+        self.full_days = {}
+        self.lock = threading.Lock()
+        # Bookings are kept in a file of their own so they survive a restart, and are shared
+        # with the other tills of the kitchen through the slot events
+        self.store_id = store_id
+        self.bookings_file = bookings_file
+        self.bookings_stamp = None
+        self.load_bookings()
+
+    def load_bookings(self):
+        if not self.bookings_file:
+            return
+        try:
+            with open(self.bookings_file, 'r') as file:
+                bookings = json.load(file)
+            self.bookings_stamp = os.stat(self.bookings_file).st_mtime_ns
+        except FileNotFoundError:
+            return
+        current = self.slot_index(time.time())
+        self.used = {}
+        self.full_days = {}
+        for index, (pizzas, prep) in bookings.items():
+            if int(index) >= current:
+                self.used[int(index)] = (pizzas, prep)
+                self.mark(int(index))
+
+    def save_bookings(self):
+        if not self.bookings_file:
+            return
+        current = self.slot_index(time.time())
+        bookings = {str(index): list(used) for index, used in self.used.items() if index >= current and any(used)}
+        with open(self.bookings_file + '.tmp', 'w') as file:
+            json.dump(bookings, file)
+        os.replace(self.bookings_file + '.tmp', self.bookings_file)
+        self.bookings_stamp = os.stat(self.bookings_file).st_mtime_ns
+
+    def refresh_bookings(self):
+        # Another process on this machine may have booked since the file was read
+        try:
+            stamp = os.stat(self.bookings_file).st_mtime_ns if self.bookings_file else None
+        except FileNotFoundError:
+            stamp = None
+        if stamp != self.bookings_stamp:
+            self.load_bookings()
+
+    def reserve(self, index, pizzas, prep):
+        used_pizzas, used_prep = self.used.get(index, (0, 0.0))
+        self.used[index] = (max(0, used_pizzas + pizzas), max(0.0, used_prep + prep))
+        self.mark(index)
+        self.save_bookings()
+
+    def apply_booking(self, event_type, data):
+        # A booking made or released at another till, received through sync
+        sign = 1 if event_type == 'slot_booked' else -1
+        with self.lock:
+            self.reserve(self.slot_index(data['start']), sign * data['pizzas'], sign * data.get('prep', 0.0))
+
+    def on_event(self, event_type, data):
+        # Keeps the pizza names and recipes used to size orders in step with menu and recipe edits
+        if event_type in ('recipe_added', 'recipe_updated'):
+            if event_type == 'recipe_updated':
+                self.recipes.pop(data['old_name'], None)
+            recipe = data['recipe']
+            self.recipes[recipe['name']] = Recipe(recipe['name'], recipe['category'], recipe['ingredients'], recipe.get('quantities'))
+        elif event_type == 'recipe_deleted':
+            self.recipes.pop(data['name'], None)
+        elif data.get('store') != self.store_id or data['category'] != 'Pizza':
+            return
+        elif event_type == 'menu_item_added':
+            self.pizza_names.add(data['item']['name'])
+        elif event_type == 'menu_item_updated':
+            self.pizza_names.discard(data['old_name'])
+            self.pizza_names.add(data['item']['name'])
+        elif event_type == 'menu_item_deleted':
+            self.pizza_names.discard(data['name'])
+
+    def attach(self, bus):
+        for event_type in SCHEDULING_EVENTS:
+            bus.subscribe(event_type, self.on_event)
+
+    def item_demand(self, item):
+        ingredients = item.get('ingredients')
+        if not ingredients and item['name'] in self.recipes:
+            ingredients = self.recipes[item['name']].ingredients
+        if ingredients or item['name'] in self.pizza_names:
+            prep = self.base_prep_minutes + self.prep_minutes_per_ingredient * len(ingredients or [])
+            return item['quantity'], item['quantity'] * prep
+        return 0, item['quantity'] * self.side_prep_minutes
+
+    def order_demand(self, order):
+        pizzas, prep = 0, 0.0
+        for item in order.get_items():
+            item_pizzas, item_prep = self.item_demand(item)
+            pizzas += item_pizzas
+            prep += item_prep
+        return pizzas, prep
+
+    def slot_index(self, timestamp):
+        return int(timestamp // self.slot_seconds)
+
+    def fits(self, index, demand):
+        pizzas, prep = self.used.get(index, (0, 0.0))
+        return pizzas + demand[0] <= self.pizza_capacity and prep + demand[1] <= self.prep_capacity
+
+    def next_open_slot(self, index, last):
+        # Skips whole runs of full slots with one bitmap lookup per day
+        while index < last:
+            day, offset = divmod(index, self.slots_per_day)
+            open_slots = ~self.full_days.get(day, 0) & ((1 << self.slots_per_day) - 1)
+            open_slots >>= offset
+            if open_slots:
+                return index + (open_slots & -open_slots).bit_length() - 1
+            index = (day + 1) * self.slots_per_day
+        return None
+
+    def next_available(self, order, after=None):
+        demand = self.order_demand(order)
+        if demand[0] > self.pizza_capacity or demand[1] > self.prep_capacity:
+            return None  # Too big for any single slot
+        first = self.slot_index(after or time.time()) + 1
+        last = first + self.horizon_slots
+        index = self.next_open_slot(first, last)
+        while index is not None and not self.fits(index, demand):
+            index = self.next_open_slot(index + 1, last)
+        return None if index is None or index >= last else index * self.slot_seconds
+
+    def mark(self, index):
+        day, offset = divmod(index, self.slots_per_day)
+        pizzas, prep = self.used.get(index, (0, 0.0))
+        # A slot is full once not even a single side dish would fit
+        if pizzas >= self.pizza_capacity or prep + self.side_prep_minutes > self.prep_capacity:
+            self.full_days[day] = self.full_days.get(day, 0) | (1 << offset)
+        else:
+            self.full_days[day] = self.full_days.get(day, 0) & ~(1 << offset)
+
+    def book(self, order, start=None, kind='pickup'):
+        with self.lock:
+            self.refresh_bookings()
+            if start is None:
+                start = self.next_available(order)
+                if start is None:
+                    raise ValueError("No slot has enough capacity for this order")
+            index = self.slot_index(start)
+            demand = self.order_demand(order)
+            if not self.fits(index, demand):
+                raise ValueError("The chosen slot does not have enough capacity")
+            self.reserve(index, *demand)
+            order.book_slot(kind, index * self.slot_seconds)
+        event_bus.publish('slot_booked', {'kind': kind, 'start': order.fulfillment['start'], 'pizzas': demand[0],
+                                          'prep': demand[1], 'store': self.store_id})
+        return order.fulfillment['start']
+
+    def release(self, order):
+        if not order.fulfillment:
+            return
+        with self.lock:
+            self.refresh_bookings()
+            start = order.fulfillment['start']
+            demand = self.order_demand(order)
+            self.reserve(self.slot_index(start), -demand[0], -demand[1])
+            order.fulfillment = None
+        event_bus.publish('slot_released', {'start': start, 'pizzas': demand[0], 'prep': demand[1], 'store': self.store_id})
+
+
+#  STREAMING  QUERIES
+def iter_recipe_records(recipes):
+    for recipe in recipes:
+        yield recipe.to_dict()
+
+def iter_inventory_records(ingredients):
+    for ingredient in ingredients:
+        record = ingredient.to_dict()
+        record.setdefault('cost', ingredient.cost)
+        yield record
+
+def iter_menu_records(menu):
+    for category, items in menu.items():
+        for item in items:
+            yield dict(item, category=category)
+
+def query(records, where=None, fields=None):
+    for record in records:
+        if where is not None and not where(record):
+            continue
+        if fields is not None:
+            record = {field: record.get(field) for field in fields}
+        yield record
+
+def paginate(records, page_size, cursor=None, where=None, fields=None):
+    # The cursor counts the records consumed so far. Any iterable works, generators included,
+    # so a page is cut from the stream without building the whole result first.
+    position = int(cursor or 0)
+    page = []
+    for record in islice(records, position, None):
+        position += 1
+        if where is not None and not where(record):
+            continue
+        if len(page) == page_size:
+            # Another match exists, the next page starts with it
+            return page, str(position - 1)
+        page.append(record if fields is None else {field: record.get(field) for field in fields})
+    return page, None
+
+def stream_json(records, file):
+    file.write('[')
+    for index, record in enumerate(records):
+        if index:
+            file.write(',\n')
+        file.write(json.dumps(record))
+    file.write(']\n')
+
+def stream_csv(records, file, fields):
+    writer = csv.writer(file)
+    writer.writerow(fields)
+    for record in records:
+        writer.writerow([', '.join(value) if isinstance(value, list) else value
+                         for value in (record.get(field) for field in fields)])
+
+EXPORT_FIELDS = {
+    'recipes': ['name', 'category', 'ingredients'],
+    'inventory': ['name', 'stock', 'cost'],
+    'menu': ['category', 'name', 'description', 'ingredients', 'price'],
+}
+
+def export_section(records, filename, section, file_format='json', where=None, fields=None):
+    records = query(records, where, fields)
+    with open(filename, 'w', newline='') as file:
+        if file_format == 'json':
+            stream_json(records, file)
+        elif file_format == 'csv':
+            stream_csv(records, file, fields or EXPORT_FIELDS[section])
+        else:
+            raise ValueError(f"Unknown export format: {file_format}")
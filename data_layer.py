@@ -1,35 +1,98 @@
 import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+from datetime import date
+from contextlib import contextmanager
+from collections.abc import MutableSequence
+
+logger = logging.getLogger(__name__)
+
+def dump_json_stream(data, file, streams):
+    # Same output as json.dump, but the sections in streams are written record by record
+    file.write('{')
+    keys = list(data) + [key for key in streams if key not in data]
+    for position, key in enumerate(keys):
+        if position:
+            file.write(', ')
+        file.write(json.dumps(key) + ': ')
+        if key in streams:
+            file.write('[')
+            for index, record in enumerate(streams[key]):
+                if index:
+                    file.write(', ')
+                file.write(json.dumps(record))
+            file.write(']')
+        else:
+            file.write(json.dumps(data[key]))
+    file.write('}')
+
+def delete_matching(records, predicate):
+    # Deletes in place from the end so no filtered copy of the list is built
+    for index in range(len(records) - 1, -1, -1):
+        if predicate(records[index]):
+            del records[index]
 
 #  RECIPE  MANAGEMENT
 class Recipe:
-    def __init__(self, name, category, ingredients):
+    def __init__(self, name, category, ingredients, quantities=None):
         self.name = name
         self.category = category
         self.ingredients = ingredients
+        # {ingredient name: units used}, ingredients not listed use one unit
+        self.quantities = quantities
+
+    def quantity(self, ingredient_name):
+        if self.quantities:
+            return self.quantities.get(ingredient_name, 1)
+        return 1
 
     def to_dict(self):
-        return {'name': self.name, 'category': self.category, 'ingredients': self.ingredients}
+        recipe = {'name': self.name, 'category': self.category, 'ingredients': self.ingredients}
+        if self.quantities:
+            recipe['quantities'] = self.quantities
+        return recipe
 
 class PizzaStore:
     def __init__(self):
         self.recipes = []
 
-    def add_recipe(self, recipe):
-        self.recipes.append(recipe)
+    def add_recipe(self, recipe, index=None):
+        if index is None:
+            self.recipes.append(recipe)
+        else:
+            self.recipes.insert(index, recipe)
+        event_bus.publish('recipe_added', {'recipe': recipe.to_dict()})
 
     def delete_recipe(self, recipe):
         self.recipes.remove(recipe)
+        event_bus.publish('recipe_deleted', {'name': recipe.name})
 
     def update_recipe(self, old_recipe, new_recipe):
         index = self.recipes.index(old_recipe)
         self.recipes[index] = new_recipe
+        event_bus.publish('recipe_updated', {'old_name': old_recipe.name, 'recipe': new_recipe.to_dict()})
+
+    def get_all_recipes(self):
+        return self.recipes
 
     def get_recipes_by_category(self, category):
-        return [recipe for recipe in self.recipes if recipe.category == category]
+        return list(self.iter_recipes(category=category))
 
     def search_recipes(self, search_term):
-        search_term = search_term.lower()
-        return [recipe for recipe in self.recipes if search_term in recipe.name.lower() or search_term in recipe.category.lower()]
+        return list(self.iter_recipes(search_term=search_term))
+
+    def iter_recipes(self, search_term=None, category=None):
+        search_term = search_term.lower() if search_term else None
+        for recipe in self.recipes:
+            if category is not None and recipe.category != category:
+                continue
+            if search_term and search_term not in recipe.name.lower() and search_term not in recipe.category.lower():
+                continue
+            yield recipe
 
     def save_to_file(self, filename):
         existing_data = {}
@@ -39,32 +102,53 @@ class PizzaStore:
         except FileNotFoundError:
             pass
 
-        existing_data['recipes'] = [recipe.to_dict() for recipe in self.recipes]
-
         with open(filename, 'w') as file:
-            json.dump(existing_data, file)
+            dump_json_stream(existing_data, file, {'recipes': (recipe.to_dict() for recipe in self.recipes)})
 
     def load_from_file(self, filename):
+        # The binary snapshot saves parsing the whole file, data.json stays the source of truth
+        if self.load_from_snapshot(filename):
+            return
         with open(filename, 'r') as file:
             data = json.load(file)
             recipes_data = data.get('recipes', [])
-            self.recipes = [Recipe(recipe['name'], recipe['category'], recipe['ingredients']) for recipe in recipes_data]
+            self.recipes = [Recipe(recipe['name'], recipe['category'], recipe['ingredients'], recipe.get('quantities')) for recipe in recipes_data]
+
+    def load_from_snapshot(self, filename):
+        snapshot = load_snapshot(filename)
+        if snapshot is None:
+            return False
+        self.recipes = snapshot.recipes()
+        return True
 
 #  INVENTORY  MANAGEMENT
 class AbstractIngredient:
-    def __init__(self, name, stock):
+    def __init__(self, name, stock, cost=0.0):
         self.name = name
         self.stock = stock
+        self.cost = cost
+
+    def to_dict(self):
+        ingredient = {"name": self.name, "stock": self.stock}
+        if self.cost:
+            ingredient["cost"] = self.cost
+        return ingredient
 
 class Ingredient(AbstractIngredient):
     pass
 
 class AbstractInventory:
-    def __init__(self):
+    def __init__(self, store_id=None):
         self.ingredients = []
+        # Stock belongs to one store, so its events say which one
+        self.store_id = store_id
+
+    def publish(self, event_type, data):
+        event_bus.publish(event_type, dict(data, store=self.store_id))
 
     def add_ingredient(self, ingredient):
         self.ingredients.append(ingredient)
+        self.publish('ingredient_added', {'ingredient': ingredient.to_dict()})
 
     def get_ingredients(self):
         return self.ingredients
@@ -73,39 +157,145 @@ class AbstractInventory:
         try:
             with open(filename, 'r') as file:
                 data = json.load(file)
-                data['inventory'] = [{"name": ingredient.name, "stock": ingredient.stock} for ingredient in self.ingredients]
 
             with open(filename, 'w') as file:
-                json.dump(data, file)
+                dump_json_stream(data, file, {'inventory': (ingredient.to_dict() for ingredient in self.ingredients)})
         except FileNotFoundError:
             pass  # File doesn't exist yet
 
     def load_from_json(self, filename):
         try:
+            if self.load_from_snapshot(filename):
+                return
             with open(filename, 'r') as file:
                 data = json.load(file)
                 inventory_data = data.get('inventory', [])
-                self.ingredients = [Ingredient(item["name"], item["stock"]) for item in inventory_data]
+                self.ingredients = [Ingredient(item["name"], item["stock"], item.get("cost", 0.0)) for item in inventory_data]
         except FileNotFoundError:
             pass  # File doesn't exist yet
+
+    def load_from_snapshot(self, filename):
+        snapshot = load_snapshot(filename)
+        if snapshot is None:
+            return False
+        self.ingredients = snapshot.ingredients()
+        return True
     
     def delete_ingredient(self, ingredient_name):
-        self.ingredients = [ingredient for ingredient in self.ingredients if ingredient.name != ingredient_name]
+        count = len(self.ingredients)
+        delete_matching(self.ingredients, lambda ingredient: ingredient.name == ingredient_name)
+        if len(self.ingredients) < count:
+            self.publish('ingredient_deleted', {'name': ingredient_name})
 
     def update_ingredient(self, ingredient_name, new_stock):
         for ingredient in self.ingredients:
             if ingredient.name == ingredient_name:
+                old_stock = ingredient.stock
                 ingredient.stock = new_stock
+                self.publish('stock_changed', {'name': ingredient_name, 'old_stock': old_stock, 'stock': new_stock})
                 break
 
+    def update_ingredient_cost(self, ingredient_name, new_cost):
+        for ingredient in self.ingredients:
+            if ingredient.name == ingredient_name:
+                old_cost = ingredient.cost
+                ingredient.cost = new_cost
+                self.publish('cost_changed', {'name': ingredient_name, 'old_cost': old_cost, 'cost': new_cost})
+                break
+
+class ConsumptionHistory:
+    def __init__(self):
+        # {iso date: {ingredient name: quantity used}}
+        self.days = {}
+
+    def record(self, ingredient_name, quantity, day=None):
+        day = (day or date.today()).isoformat()
+        usage = self.days.setdefault(day, {})
+        usage[ingredient_name] = usage.get(ingredient_name, 0) + quantity
+        # An undone consumption takes its amount back out and leaves no trace
+        if not usage[ingredient_name]:
+            del usage[ingredient_name]
+            if not usage:
+                del self.days[day]
+
+    def as_matrix(self, ingredient_names, today=None):
+        # One row per calendar day up to today (missing days count as zero), one column per ingredient
+        if not self.days:
+            return []
+        ordinals = sorted(date.fromisoformat(day).toordinal() for day in self.days)
+        last = max(ordinals[-1], (today or date.today()).toordinal())
+        rows = []
+        for ordinal in range(ordinals[0], last + 1):
+            usage = self.days.get(date.fromordinal(ordinal).isoformat(), {})
+            rows.append([usage.get(name, 0) for name in ingredient_names])
+        return rows
+
+    def save_to_json(self, filename):
+        try:
+            with open(filename, 'r') as file:
+                data = json.load(file)
+                data['consumption'] = self.days
+
+            with open(filename, 'w') as file:
+                json.dump(data, file)
+        except FileNotFoundError:
+            pass  # File doesn't exist yet
+
+    def load_from_json(self, filename):
+        try:
+            snapshot = load_snapshot(filename)
+            if snapshot is not None:
+                self.days = snapshot.section('consumption', {})
+                return
+            with open(filename, 'r') as file:
+                self.days = json.load(file).get('consumption', {})
+        except FileNotFoundError:
+            pass  # File doesn't exist yet
+
+class IngredientAttributes:
+    def __init__(self):
+        # {ingredient name: {"allergens": [...], "vegetarian": bool, "vegan": bool}}
+        self.attributes = {}
+
+    def get(self, ingredient_name):
+        return self.attributes.get(ingredient_name.strip())
+
+    def set(self, ingredient_name, allergens=(), vegetarian=True, vegan=True):
+        self.attributes[ingredient_name.strip()] = {"allergens": sorted(allergens), "vegetarian": vegetarian, "vegan": vegan and vegetarian}
+
+    def save_to_json(self, filename):
+        try:
+            with open(filename, 'r') as file:
+                data = json.load(file)
+                data['ingredient_attributes'] = self.attributes
+
+            with open(filename, 'w') as file:
+                json.dump(data, file)
+        except FileNotFoundError:
+            pass  # File doesn't exist yet
+
+    def load_from_json(self, filename):
+        try:
+            snapshot = load_snapshot(filename)
+            if snapshot is not None:
+                self.attributes = snapshot.section('ingredient_attributes', {})
+                return
+            with open(filename, 'r') as file:
+                self.attributes = json.load(file).get('ingredient_attributes', {})
+        except FileNotFoundError:
+            pass  # File doesn't exist yet
+
 #  MENU  MANAGEMENT
 class AbstractMenu:
-    def __init__(self):
-        self.menu_file = 'data.json'
+    def __init__(self, menu_file='data.json'):
+        self.menu_file = menu_file
         self.menu = {}
+        self.store_id = None
 
     def load_menu(self):
         try:
+            if self.load_menu_from_snapshot():
+                return
             with open(self.menu_file, 'r') as file:
                 data = json.load(file)
                 loaded_menu = data.get('menu', {})
@@ -113,6 +303,13 @@ class AbstractMenu:
         except FileNotFoundError:
             self.menu = {}
 
+    def load_menu_from_snapshot(self):
+        snapshot = load_snapshot(self.menu_file)
+        if snapshot is None:
+            return False
+        self.menu.update(snapshot.menu())
+        return True
+
     def save_menu(self):
         try:
             with open(self.menu_file, 'r') as file:
@@ -120,7 +317,7 @@ class AbstractMenu:
         except FileNotFoundError:
             data = {}
 
-        data['menu'] = self.menu
+        data['menu'] = {category: list(items) for category, items in self.menu.items()}
 
         with open(self.menu_file, 'w') as file:
             json.dump(data, file)
@@ -133,13 +330,616 @@ class Menu(AbstractMenu):
 class Order:
     def __init__(self):
         self.items = []
+        self.total = 0.0
+        self.lines = {}
+        # {"kind": "pickup" or "delivery", "start": slot start timestamp}
+        self.fulfillment = None
+
+    @staticmethod
+    def line_key(name, ingredients=None):
+        return (name, tuple(ingredients) if ingredients else None)
 
     def add_item(self, name, quantity, total_price, ingredients=None):
-        item = {"name": name, "quantity": quantity, "total_price": total_price, "ingredients": ingredients}
-        self.items.append(item)
+        # Repeated items are merged into the existing line
+        key = self.line_key(name, ingredients)
+        item = self.lines.get(key)
+        if item is None:
+            item = {"name": name, "quantity": quantity, "total_price": total_price, "ingredients": ingredients}
+            self.lines[key] = item
+            self.items.append(item)
+        else:
+            item["quantity"] += quantity
+            item["total_price"] += total_price
+        self.total += total_price
+        return item
+
+    def add_items(self, items):
+        changed = {}
+        for item in items:
+            line = self.add_item(item["name"], item["quantity"], item["total_price"], item.get("ingredients"))
+            changed[id(line)] = line
+        return list(changed.values())
+
+    def clone(self):
+        order = Order()
+        order.add_items(self.items)
+        return order
 
     def get_items(self):
         return self.items
 
+    def get_total(self):
+        return self.total
+
+    def book_slot(self, kind, start):
+        self.fulfillment = {"kind": kind, "start": start}
+
     def get_order_details(self):
-        return {"items": self.items}
+        return {"items": self.items, "total": self.total, "fulfillment": self.fulfillment}
+
+    def place(self, order_number=None):
+        event_bus.publish('order_placed', {'order_number': order_number, 'items': self.items, 'total': self.total,
+                                           'fulfillment': self.fulfillment})
+
+
+#  BINARY  SNAPSHOT
+# Layout: header, string offsets + string blob, then fixed-width record arrays.
+# Records reference strings by index into the string table, ingredient lists are
+# ranges of a shared reference array with a parallel array of quantities. Sections
+# without a fixed layout (consumption, ingredient attributes, ...) are kept as JSON text.
+# The header carries the mtime and size of the JSON file the snapshot was built from.
+SNAPSHOT_MAGIC = b'PZSNAP04'
+SNAPSHOT_HEADER = struct.Struct('<8sqqIIIIIII')
+SNAPSHOT_OFFSET = struct.Struct('<I')
+SNAPSHOT_QUANTITY = struct.Struct('<d')
+SNAPSHOT_RECIPE = struct.Struct('<IIIIBB')
+SNAPSHOT_INGREDIENT = struct.Struct('<Iqd')
+SNAPSHOT_CATEGORY = struct.Struct('<III')
+SNAPSHOT_MENU_ITEM = struct.Struct('<IIIIBBId')
+SNAPSHOT_SECTION = struct.Struct('<II')
+SNAPSHOT_SECTIONS = ('recipes', 'inventory', 'menu')
+
+INGREDIENTS_NONE = 0
+INGREDIENTS_TEXT = 1
+INGREDIENTS_LIST = 2
+MENU_HAS_DESCRIPTION = 1
+MENU_HAS_PRICE = 2
+MENU_ITEM_FIELDS = ('name', 'description', 'ingredients', 'price')
+NO_STRING = 0xFFFFFFFF
+
+
+def snapshot_path(filename):
+    return os.path.splitext(filename)[0] + '.bin'
+
+
+def check_snapshot_value(condition, field, record):
+    if not condition:
+        raise ValueError(f"Cannot snapshot {field} of {record!r}")
+
+
+def write_snapshot(filename, snapshot_filename=None):
+    snapshot_filename = snapshot_filename or snapshot_path(filename)
+    with open(filename, 'r') as file:
+        # Stat before reading: a write that lands after this point changes the stamp and
+        # makes the next open rebuild the snapshot
+        source = os.fstat(file.fileno())
+        data = json.load(file)
+
+    strings = {}
+
+    def intern(value):
+        index = strings.get(value)
+        if index is None:
+            index = strings[value] = len(strings)
+        return index
+
+    refs = []
+    quantities = []
+
+    def pack_ingredients(ingredients, record, ingredient_quantities=None):
+        # Returns (kind, start, count), free text is a single string reference like a name
+        if ingredients is None:
+            return INGREDIENTS_NONE, 0, 0
+        if isinstance(ingredients, str):
+            check_snapshot_value(not ingredient_quantities, 'quantities', record)
+            return INGREDIENTS_TEXT, intern(ingredients), 0
+        check_snapshot_value(isinstance(ingredients, list) and all(isinstance(name, str) for name in ingredients),
+                             'ingredients', record)
+        ingredient_quantities = ingredient_quantities or {}
+        check_snapshot_value(isinstance(ingredient_quantities, dict) and set(ingredient_quantities) <= set(ingredients),
+                             'quantities', record)
+        start = len(refs)
+        refs.extend(intern(ingredient) for ingredient in ingredients)
+        quantities.extend(ingredient_quantities.get(ingredient, 1) for ingredient in ingredients)
+        return INGREDIENTS_LIST, start, len(refs) - start
+
+    recipe_records = []
+    for recipe in data.get('recipes', []):
+        check_snapshot_value(isinstance(recipe, dict) and isinstance(recipe.get('name'), str)
+                             and isinstance(recipe.get('category'), str) and 'ingredients' in recipe, 'fields', recipe)
+        recipe_quantities = recipe.get('quantities')
+        kind, start, count = pack_ingredients(recipe['ingredients'], recipe, recipe_quantities)
+        recipe_records.append(SNAPSHOT_RECIPE.pack(intern(recipe['name']), intern(recipe['category']), start, count,
+                                                   kind, bool(recipe_quantities)))
+
+    ingredient_records = []
+    for item in data.get('inventory', []):
+        check_snapshot_value(isinstance(item, dict) and isinstance(item.get('name'), str), 'name', item)
+        ingredient_records.append(SNAPSHOT_INGREDIENT.pack(intern(item['name']), item['stock'], item.get('cost', 0.0)))
+
+    category_records = []
+    menu_records = []
+    for category, items in data.get('menu', {}).items():
+        category_records.append(SNAPSHOT_CATEGORY.pack(intern(category), len(menu_records), len(items)))
+        for item in items:
+            check_snapshot_value(isinstance(item, dict) and isinstance(item.get('name'), str)
+                                 and isinstance(item.get('description', ''), str), 'fields', item)
+            kind, start, count = pack_ingredients(item.get('ingredients'), item)
+            flags = (MENU_HAS_DESCRIPTION if 'description' in item else 0) | (MENU_HAS_PRICE if 'price' in item else 0)
+            # Fields the fixed layout does not cover (store overrides, recipe links) travel as JSON
+            extras = {key: value for key, value in item.items() if key not in MENU_ITEM_FIELDS}
+            menu_records.append(SNAPSHOT_MENU_ITEM.pack(intern(item['name']), intern(item.get('description', '')),
+                                                        start, count, kind, flags,
+                                                        intern(json.dumps(extras)) if extras else NO_STRING,
+                                                        item.get('price', 0.0)))
+
+    section_records = [SNAPSHOT_SECTION.pack(intern(key), intern(json.dumps(value)))
+                       for key, value in data.items() if key not in SNAPSHOT_SECTIONS]
+
+    encoded = [value.encode('utf-8') for value in strings]
+    offsets = [0]
+    for value in encoded:
+        offsets.append(offsets[-1] + len(value))
+
+    content = b''.join([
+        SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, source.st_mtime_ns, source.st_size, len(encoded), len(refs), len(recipe_records), len(ingredient_records),
+                             len(category_records), len(menu_records), len(section_records)),
+        struct.pack(f'<{len(offsets)}I', *offsets),
+        b''.join(encoded),
+        struct.pack(f'<{len(refs)}I', *refs),
+        struct.pack(f'<{len(quantities)}d', *quantities),
+        b''.join(recipe_records),
+        b''.join(ingredient_records),
+        b''.join(category_records),
+        b''.join(menu_records),
+        b''.join(section_records),
+    ])
+    # Every process writes its own temporary file, the rename makes the new snapshot visible at once
+    temp_filename = f'{snapshot_filename}.{os.getpid()}.tmp'
+    with open(temp_filename, 'wb') as file:
+        file.write(content)
+    os.replace(temp_filename, snapshot_filename)
+    return snapshot_filename
+
+
+def open_snapshot(filename):
+    # Regenerate the snapshot unless it was built from the JSON file as it is now
+    source = os.stat(filename)
+    snapshot_filename = snapshot_path(filename)
+    try:
+        snapshot = Snapshot(snapshot_filename)
+    except (FileNotFoundError, ValueError, struct.error):
+        snapshot = None  # Missing, empty or written by an older snapshot format
+    if snapshot is not None:
+        if snapshot.source == (source.st_mtime_ns, source.st_size):
+            return snapshot
+        snapshot.close()
+    write_snapshot(filename, snapshot_filename)
+    return Snapshot(snapshot_filename)
+
+
+def load_snapshot(filename):
+    # None tells the caller to read the JSON file itself: the snapshot could not be written
+    # (read-only folder, or the old one is still mapped on Windows) or the data has values
+    # the fixed-width layout cannot hold. A missing file is left to the caller as before.
+    try:
+        return open_snapshot(filename)
+    except FileNotFoundError:
+        raise
+    except Exception:
+        logger.info("Reading %s without a snapshot", filename, exc_info=True)
+        return None
+
+
+class LazyRecords(MutableSequence):
+    def __init__(self, count, materialize):
+        self._count = count
+        self._materialize = materialize
+        self._cache = {}
+        self._slots = None
+
+    def __len__(self):
+        return self._count if self._slots is None else len(self._slots)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        index = range(len(self))[index]
+        if self._slots is None:
+            item = self._cache.get(index)
+            if item is None:
+                # setdefault so threads reading the same record at once all get one shared object
+                item = self._cache.setdefault(index, self._materialize(index))
+            return item
+        # Unmaterialized slots hold their record number
+        item = self._slots[index]
+        if type(item) is int:
+            item = self._slots[index] = self._materialize(item)
+        return item
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def _unfreeze(self):
+        if self._slots is None:
+            self._slots = list(range(self._count))
+            for index, item in self._cache.items():
+                self._slots[index] = item
+            self._cache = None
+
+    def __setitem__(self, index, value):
+        self._unfreeze()
+        self._slots[index] = value
+
+    def __delitem__(self, index):
+        self._unfreeze()
+        del self._slots[index]
+
+    def insert(self, index, value):
+        self._unfreeze()
+        self._slots.insert(index, value)
+
+
+class Snapshot:
+    def __init__(self, filename):
+        with open(filename, 'rb') as file:
+            self._buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, source_mtime, source_size, string_count, ref_count, self.recipe_count, self.ingredient_count,
+         category_count, self.menu_item_count, self.section_count) = SNAPSHOT_HEADER.unpack_from(self._buffer, 0)
+        if magic != SNAPSHOT_MAGIC:
+            self._buffer.close()
+            raise ValueError(f"{filename} is not a pizza store snapshot")
+        self.source = (source_mtime, source_size)
+
+        self._offsets = SNAPSHOT_HEADER.size
+        self._strings = self._offsets + (string_count + 1) * SNAPSHOT_OFFSET.size
+        self._refs = self._strings + self._string_offset(string_count)
+        self._quantities = self._refs + ref_count * SNAPSHOT_OFFSET.size
+        self._recipes = self._quantities + ref_count * SNAPSHOT_QUANTITY.size
+        self._ingredients = self._recipes + self.recipe_count * SNAPSHOT_RECIPE.size
+        self._categories = self._ingredients + self.ingredient_count * SNAPSHOT_INGREDIENT.size
+        self._menu_items = self._categories + category_count * SNAPSHOT_CATEGORY.size
+        self._sections = self._menu_items + self.menu_item_count * SNAPSHOT_MENU_ITEM.size
+        self.category_count = category_count
+        self._string_cache = {}
+
+    def _string_offset(self, index):
+        return SNAPSHOT_OFFSET.unpack_from(self._buffer, self._offsets + index * SNAPSHOT_OFFSET.size)[0]
+
+    def string(self, index):
+        value = self._string_cache.get(index)
+        if value is None:
+            start = self._strings + self._string_offset(index)
+            end = self._strings + self._string_offset(index + 1)
+            value = self._string_cache[index] = self._buffer[start:end].decode('utf-8')
+        return value
+
+    def _string_list(self, start, count):
+        refs = struct.unpack_from(f'<{count}I', self._buffer, self._refs + start * SNAPSHOT_OFFSET.size)
+        return [self.string(ref) for ref in refs]
+
+    def _ingredients_value(self, kind, start, count):
+        if kind == INGREDIENTS_TEXT:
+            return self.string(start)
+        if kind == INGREDIENTS_LIST:
+            return self._string_list(start, count)
+        return None
+
+    def recipe(self, index):
+        name, category, start, count, kind, has_quantities = SNAPSHOT_RECIPE.unpack_from(
+            self._buffer, self._recipes + index * SNAPSHOT_RECIPE.size)
+        ingredients = self._ingredients_value(kind, start, count)
+        quantities = None
+        if has_quantities and kind == INGREDIENTS_LIST:
+            values = struct.unpack_from(f'<{count}d', self._buffer, self._quantities + start * SNAPSHOT_QUANTITY.size)
+            quantities = dict(zip(ingredients, values))
+        return Recipe(self.string(name), self.string(category), ingredients, quantities)
+
+    def ingredient(self, index):
+        name, stock, cost = SNAPSHOT_INGREDIENT.unpack_from(self._buffer, self._ingredients + index * SNAPSHOT_INGREDIENT.size)
+        return Ingredient(self.string(name), stock, cost)
+
+    def menu_item(self, index):
+        name, description, start, count, kind, flags, extras, price = SNAPSHOT_MENU_ITEM.unpack_from(
+            self._buffer, self._menu_items + index * SNAPSHOT_MENU_ITEM.size)
+        item = {'name': self.string(name)}
+        if flags & MENU_HAS_DESCRIPTION:
+            item['description'] = self.string(description)
+        if kind != INGREDIENTS_NONE:
+            item['ingredients'] = self._ingredients_value(kind, start, count)
+        if flags & MENU_HAS_PRICE:
+            item['price'] = price
+        if extras != NO_STRING:
+            item.update(json.loads(self.string(extras)))
+        return item
+
+    def recipes(self):
+        return LazyRecords(self.recipe_count, self.recipe)
+
+    def ingredients(self):
+        return LazyRecords(self.ingredient_count, self.ingredient)
+
+    def menu(self):
+        menu = {}
+        for index in range(self.category_count):
+            name, start, count = SNAPSHOT_CATEGORY.unpack_from(self._buffer, self._categories + index * SNAPSHOT_CATEGORY.size)
+            menu[self.string(name)] = LazyRecords(count, lambda offset, start=start: self.menu_item(start + offset))
+        return menu
+
+    def section(self, key, default=None):
+        for index in range(self.section_count):
+            name, value = SNAPSHOT_SECTION.unpack_from(self._buffer, self._sections + index * SNAPSHOT_SECTION.size)
+            if self.string(name) == key:
+                return json.loads(self.string(value))
+        return default
+
+    def close(self):
+        self._buffer.close()
+
+
+#  MULTI-STORE
+# The catalog file holds the shared recipes and base menu. Each store has its own
+# shard under stores_dir with its inventory and the menu items it overrides.
+def merge_menus(base_menu, overrides):
+    merged = {}
+    for category in list(base_menu) + [category for category in overrides if category not in base_menu]:
+        store_items = {item['name']: item for item in overrides.get(category, [])}
+        items = []
+        for item in base_menu.get(category, []):
+            items.append(store_items.pop(item['name'], item))
+        items.extend(store_items.values())
+        merged[category] = [item for item in items if item.get('available', True)]
+    return merged
+
+
+class StoreMenu(AbstractMenu):
+    def __init__(self, catalog_file, store_file, store_id=None):
+        super().__init__(store_file)
+        self.catalog_file = catalog_file
+        self.store_id = store_id
+
+    def load_catalog_menu(self):
+        catalog = Menu(self.catalog_file)
+        catalog.load_menu()
+        return catalog.menu
+
+    def load_overrides(self):
+        try:
+            with open(self.menu_file, 'r') as file:
+                return json.load(file).get('menu', {})
+        except FileNotFoundError:
+            return {}
+
+    def load_menu(self):
+        self.menu.update(merge_menus(self.load_catalog_menu(), self.load_overrides()))
+
+    def load_menu_from_snapshot(self):
+        # The catalog menu already comes from its snapshot; a shard only holds a few overrides
+        self.load_menu()
+        return True
+
+    def save_menu(self):
+        # Only store what differs from the catalog, hiding removed catalog items
+        base_menu = self.load_catalog_menu()
+        overrides = {}
+        for category in list(base_menu) + [category for category in self.menu if category not in base_menu]:
+            base_items = {item['name']: item for item in base_menu.get(category, [])}
+            store_items = {item['name']: item for item in self.menu.get(category, [])}
+            changed = [item for name, item in store_items.items() if base_items.get(name) != item]
+            changed += [{'name': name, 'available': False} for name in base_items if name not in store_items]
+            if changed:
+                overrides[category] = changed
+
+        try:
+            with open(self.menu_file, 'r') as file:
+                data = json.load(file)
+        except FileNotFoundError:
+            data = {}
+
+        data['menu'] = overrides
+
+        with open(self.menu_file, 'w') as file:
+            json.dump(data, file)
+
+
+class StoreRouter:
+    def __init__(self, catalog_file='data.json', stores_dir='stores', active_store=None):
+        self.catalog_file = catalog_file
+        self.stores_dir = stores_dir
+        self.active_store = None
+        if active_store is not None:
+            self.activate(active_store)
+
+    def activate(self, store_id):
+        # Saves into a shard that does not exist yet would be dropped, so create it up front
+        if store_id is not None:
+            self.create_store(store_id)
+        self.active_store = store_id
+
+    def store_file(self, store_id=None):
+        store_id = store_id or self.active_store
+        if store_id is None:
+            return self.catalog_file
+        return os.path.join(self.stores_dir, f'{store_id}.json')
+
+    def list_stores(self):
+        try:
+            return sorted(os.path.splitext(name)[0] for name in os.listdir(self.stores_dir) if name.endswith('.json'))
+        except FileNotFoundError:
+            return []
+
+    def create_store(self, store_id):
+        os.makedirs(self.stores_dir, exist_ok=True)
+        store_file = self.store_file(store_id)
+        if not os.path.exists(store_file):
+            with open(store_file, 'w') as file:
+                json.dump({'inventory': [], 'menu': {}}, file)
+        return store_file
+
+    def menu_handler(self, store_id=None):
+        store_id = store_id or self.active_store
+        if store_id is None:
+            return Menu(self.catalog_file)
+        return StoreMenu(self.catalog_file, self.store_file(store_id), store_id)
+
+    def load_menu(self, store_id=None):
+        handler = self.menu_handler(store_id)
+        handler.load_menu()
+        return handler.menu
+
+    def load_inventory(self, store_id=None):
+        inventory = AbstractInventory(store_id or self.active_store)
+        inventory.load_from_json(self.store_file(store_id))
+        return inventory
+
+
+#  TICKET  SPOOL
+class TicketSpool:
+    def __init__(self, spool_dir='spool'):
+        self.spool_dir = spool_dir
+
+    def write(self, name, content):
+        # Write to a temporary name first so a printer watching the folder never sees half a ticket
+        os.makedirs(self.spool_dir, exist_ok=True)
+        path = os.path.join(self.spool_dir, name)
+        mode = 'wb' if isinstance(content, bytes) else 'w'
+        with open(path + '.tmp', mode) as file:
+            file.write(content)
+        os.replace(path + '.tmp', path)
+        return path
+
+    def last_ticket_number(self):
+        try:
+            names = os.listdir(self.spool_dir)
+        except FileNotFoundError:
+            return 0
+        return max((int(name[:6]) for name in names if name[:6].isdigit()), default=0)
+
+
+#  EVENTS
+MAX_EVENT_ERRORS = 100
+
+
+class EventBus:
+    def __init__(self):
+        # {event type: [handler]}, '*' receives every event
+        self.handlers = {}
+        self.errors = []
+        self.muted = False
+        # Per thread, the list that collects the events the thread holds back
+        self.local = threading.local()
+
+    def subscribe(self, event_type, handler):
+        self.handlers.setdefault(event_type, []).append(handler)
+        return handler
+
+    def unsubscribe(self, event_type, handler):
+        if handler in self.handlers.get(event_type, []):
+            self.handlers[event_type].remove(handler)
+
+    @contextmanager
+    def mute(self):
+        # Nothing is delivered while muted, for changes that were already announced elsewhere
+        muted, self.muted = self.muted, True
+        try:
+            yield self
+        finally:
+            self.muted = muted
+
+    @contextmanager
+    def hold(self):
+        # Events published by this thread are collected instead of delivered, so a worker
+        # thread can leave it to the UI thread to deliver them
+        held, self.local.held = getattr(self.local, 'held', None), []
+        try:
+            yield self.local.held
+        finally:
+            self.local.held = held
+
+    def publish(self, event_type, data):
+        held = getattr(self.local, 'held', None)
+        if held is not None:
+            held.append((event_type, data))
+            return
+        if not self.handlers or self.muted:
+            return
+        for handler in self.handlers.get(event_type, []) + self.handlers.get('*', []):
+            # A failing subscriber must not undo or block the change that was already made
+            try:
+                handler(event_type, data)
+            except Exception as error:
+                logger.exception("Event handler %r failed for %s", handler, event_type)
+                self.errors.append((event_type, error))
+                del self.errors[:-MAX_EVENT_ERRORS]
+
+
+def read_log(filename, offset=0):
+    # Offsets are byte positions, so a consumer resumes from the offset it last saw
+    try:
+        with open(filename, 'rb') as file:
+            file.seek(offset)
+            while True:
+                line = file.readline()
+                if not line.endswith(b'\n'):
+                    break  # End of file, or a record that is still being written
+                offset += len(line)
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    logger.warning("Skipping a damaged record in %s before offset %s", filename, offset)
+                    continue
+                yield offset, record
+    except FileNotFoundError:
+        return
+
+
+class ChangeLog:
+    def __init__(self, filename='changes.log', origin=None):
+        self.filename = filename
+        self.origin = origin
+        self.lock = threading.Lock()
+        self.sequence = self.last_sequence()
+        # Set while replaying changes received from elsewhere so they are not logged again
+        self.paused = False
+
+    def last_sequence(self):
+        sequence = 0
+        for _, record in self.read():
+            sequence = record['seq']
+        return sequence
+
+    def append(self, event_type, data):
+        if self.paused:
+            return None
+        with self.lock:
+            self.sequence += 1
+            record = {'seq': self.sequence, 'time': time.time(), 'origin': self.origin, 'event': event_type, 'data': data}
+            with open(self.filename, 'a') as file:
+                file.write(json.dumps(record) + '\n')
+        return record
+
+    def attach(self, bus):
+        return bus.subscribe('*', self.append)
+
+    def read(self, offset=0):
+        return read_log(self.filename, offset)
+
+    def tail(self, offset=0, poll_interval=0.5, stop=None):
+        while not (stop and stop.is_set()):
+            for offset, record in self.read(offset):
+                yield offset, record
+            time.sleep(poll_interval)
+
+
+event_bus = EventBus()
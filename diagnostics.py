@@ -0,0 +1,126 @@
+import gc
+import json
+import threading
+import time
+import tracemalloc
+import tkinter as tk
+from tkinter import ttk
+from data_layer import Recipe, Ingredient, Order
+
+
+#  MEMORY  PROFILING
+TRACKED_CLASSES = {
+    'Recipe': Recipe,
+    'Ingredient': Ingredient,
+    'Order': Order,
+    'Toplevel': tk.Toplevel,
+    'Treeview': ttk.Treeview,
+}
+
+
+def treeview_rows(tree, parent=''):
+    children = tree.get_children(parent)
+    return len(children) + sum(treeview_rows(tree, child) for child in children)
+
+
+def object_counts():
+    counts = {name: 0 for name in TRACKED_CLASSES}
+    counts['Treeview rows'] = 0
+    counts['Destroyed widgets'] = 0
+    for obj in gc.get_objects():
+        for name, cls in TRACKED_CLASSES.items():
+            if isinstance(obj, cls):
+                counts[name] += 1
+        if isinstance(obj, (tk.Toplevel, ttk.Treeview)):
+            # Widgets that were destroyed but are still referenced from Python are a common leak
+            try:
+                exists = obj.winfo_exists()
+            except tk.TclError:
+                exists = False
+            if not exists:
+                counts['Destroyed widgets'] += 1
+            elif isinstance(obj, ttk.Treeview):
+                counts['Treeview rows'] += treeview_rows(obj)
+    return counts
+
+
+class MemoryProfiler:
+    def __init__(self, root=None, interval_seconds=600, report_file='memory_report.log', top=15, frames=10, window=5):
+        self.root = root
+        self.interval_seconds = interval_seconds
+        self.report_file = report_file
+        self.top = top
+        self.frames = frames
+        self.window = window
+        self.history = []
+        self.previous = None
+        self.timer = None
+
+    def start(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+        self.previous = tracemalloc.take_snapshot()
+        self.history.append({'time': time.time(), 'counts': object_counts(), 'traced': tracemalloc.get_traced_memory()[0]})
+        self.schedule()
+
+    def schedule(self):
+        # Sampling runs on the Tk event loop when there is one, since widgets may only be touched from that thread
+        if self.root is not None:
+            self.timer = self.root.after(int(self.interval_seconds * 1000), self.tick)
+        else:
+            self.timer = threading.Timer(self.interval_seconds, self.tick)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def stop(self):
+        if self.timer is None:
+            return
+        if self.root is not None:
+            self.root.after_cancel(self.timer)
+        else:
+            self.timer.cancel()
+        self.timer = None
+
+    def tick(self):
+        self.sample()
+        self.schedule()
+
+    def sample(self):
+        gc.collect()
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        ))
+        growth = snapshot.compare_to(self.previous, 'lineno')[:self.top] if self.previous else []
+        self.previous = snapshot
+
+        entry = {'time': time.time(), 'counts': object_counts(), 'traced': tracemalloc.get_traced_memory()[0]}
+        self.history.append(entry)
+        self.history = self.history[-(self.window + 1):]
+
+        report = {
+            'time': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(entry['time'])),
+            'traced_bytes': entry['traced'],
+            'object_counts': entry['counts'],
+            'top_growth': [{'location': str(stat.traceback[0]), 'size_diff': stat.size_diff, 'count_diff': stat.count_diff}
+                           for stat in growth if stat.size_diff > 0],
+            'suspected_leaks': self.suspected_leaks(),
+        }
+        with open(self.report_file, 'a') as file:
+            file.write(json.dumps(report) + '\n')
+        return report
+
+    def suspected_leaks(self):
+        # Anything that grew at every sample across the whole window is reported
+        if len(self.history) <= self.window:
+            return {}
+        leaks = {}
+        samples = self.history[-(self.window + 1):]
+        for name in samples[-1]['counts']:
+            values = [sample['counts'][name] for sample in samples]
+            if all(later > earlier for earlier, later in zip(values, values[1:])):
+                leaks[name] = {'from': values[0], 'to': values[-1]}
+        traced = [sample['traced'] for sample in samples]
+        if all(later > earlier for earlier, later in zip(traced, traced[1:])):
+            leaks['traced_bytes'] = {'from': traced[0], 'to': traced[-1]}
+        return leaks
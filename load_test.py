@@ -0,0 +1,241 @@
+import argparse
+import json
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+from data_layer import AbstractInventory, Menu, Order
+from business_layer import RecipeManager, InventoryManager, PizzaMenuStore
+
+
+#  LOAD  TEST
+def percentile(samples, fraction):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class LoadTest:
+    def __init__(self, data_file='data.json', tills=4, rate=20.0, duration=10.0, order_mix=None,
+                 edit_ratio=0.05, search_ratio=0.1, seed=None):
+        self.tills = tills
+        self.rate = rate
+        self.duration = duration
+        self.order_mix = order_mix or {}
+        self.edit_ratio = edit_ratio
+        self.search_ratio = search_ratio
+        self.random = random.Random(seed)
+
+        # Work on a copy so the real data file is never touched
+        self.work_dir = tempfile.mkdtemp(prefix='pizza-load-')
+        self.data_file = os.path.join(self.work_dir, 'data.json')
+        shutil.copyfile(data_file, self.data_file)
+
+        self.recipe_manager = RecipeManager()
+        self.recipe_manager.load_from_file(self.data_file)
+        self.inventory_manager = InventoryManager(AbstractInventory())
+        self.inventory_manager.load_inventory_from_json(self.data_file)
+        self.menu_store = PizzaMenuStore(Menu(self.data_file))
+        self.menu_store.load_data()
+
+        self.menu_items = [item for items in self.menu_store.menu.values() for item in items]
+        self.recipes = {recipe.name: recipe for recipe in self.recipe_manager.get_all_recipes()}
+        self.initial_stock = {ingredient.name: ingredient.stock for ingredient in self.inventory_manager.get_inventory()}
+        self.consumed = {}
+        self.latencies = {}
+        self.order_log = []
+        self.errors = []
+        self.lock = threading.Lock()
+
+    def cleanup(self):
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def item_ingredients(self, item):
+        recipe = self.recipes.get(item['name'])
+        if recipe:
+            return [name.strip() for name in recipe.ingredients]
+        ingredients = item.get('ingredients') or []
+        if isinstance(ingredients, str):
+            ingredients = ingredients.split(',')
+        return [name.strip() for name in ingredients]
+
+    def pick_item(self, rng):
+        weights = [self.order_mix.get(item['name'], 1.0) for item in self.menu_items]
+        return rng.choices(self.menu_items, weights=weights)[0]
+
+    def timed(self, operation, action, *args):
+        start = time.perf_counter()
+        try:
+            return action(*args)
+        except Exception as error:
+            with self.lock:
+                self.errors.append(f"{operation}: {error!r}")
+        finally:
+            elapsed = time.perf_counter() - start
+            with self.lock:
+                self.latencies.setdefault(operation, []).append(elapsed)
+
+    def place_order(self, lines):
+        order = Order()
+        items = {item['name']: item for item in self.menu_items}
+        for name, quantity in lines:
+            item = items[name]
+            order.add_item(name, quantity, quantity * item.get('price', 0.0))
+        # Deduct stock with the same read-then-write the inventory screen uses
+        for name, quantity in lines:
+            for ingredient_name in self.item_ingredients(items[name]):
+                for ingredient in self.inventory_manager.get_inventory():
+                    if ingredient.name == ingredient_name:
+                        self.inventory_manager.update_ingredient(ingredient_name, ingredient.stock - quantity)
+                        with self.lock:
+                            self.consumed[ingredient_name] = self.consumed.get(ingredient_name, 0) + quantity
+                        break
+        return order.get_total()
+
+    def edit_menu(self, rng):
+        pizzas = self.menu_store.menu.get('Pizza', [])
+        if pizzas:
+            pizza = rng.choice(pizzas)
+            self.menu_store.update_pizza_in_menu(pizza['name'], pizza['name'], pizza.get('description', ''),
+                                                 pizza.get('ingredients', ''), pizza.get('price', 0.0))
+
+    def search_recipes(self, rng):
+        return self.recipe_manager.search_recipes(rng.choice(list(self.recipes) or ['']))
+
+    def random_order(self, rng):
+        return [(self.pick_item(rng)['name'], rng.randint(1, 3)) for _ in range(rng.randint(1, 4))]
+
+    def till(self, till_id, deadline, started):
+        rng = random.Random(self.random.random())
+        while time.perf_counter() < deadline:
+            # Poisson arrivals, the total rate is split across the tills
+            time.sleep(rng.expovariate(self.rate / self.tills))
+            roll = rng.random()
+            if roll < self.edit_ratio:
+                self.timed('edit_menu', self.edit_menu, rng)
+            elif roll < self.edit_ratio + self.search_ratio:
+                self.timed('search_recipes', self.search_recipes, rng)
+            else:
+                lines = self.random_order(rng)
+                with self.lock:
+                    self.order_log.append({'t': time.perf_counter() - started, 'till': till_id, 'items': lines})
+                self.timed('place_order', self.place_order, lines)
+
+    def run(self):
+        started = time.perf_counter()
+        deadline = started + self.duration
+        threads = [threading.Thread(target=self.till, args=(till_id, deadline, started)) for till_id in range(self.tills)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return self.report(time.perf_counter() - started)
+
+    def replay(self, log, realtime=False):
+        # Orders from a recorded log are split back over the tills that took them
+        started = time.perf_counter()
+        by_till = {}
+        for entry in log:
+            by_till.setdefault(entry.get('till', 0), []).append(entry)
+
+        def till(entries):
+            for entry in entries:
+                if realtime:
+                    delay = entry['t'] - (time.perf_counter() - started)
+                    if delay > 0:
+                        time.sleep(delay)
+                self.timed('place_order', self.place_order, [tuple(line) for line in entry['items']])
+
+        threads = [threading.Thread(target=till, args=(entries,)) for entries in by_till.values()]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return self.report(time.perf_counter() - started)
+
+    def stock_violations(self):
+        violations = []
+        for ingredient in self.inventory_manager.get_inventory():
+            expected = self.initial_stock.get(ingredient.name, 0) - self.consumed.get(ingredient.name, 0)
+            if ingredient.stock != expected:
+                violations.append({'name': ingredient.name, 'expected': expected, 'actual': ingredient.stock, 'kind': 'lost_update'})
+            if ingredient.stock < 0:
+                violations.append({'name': ingredient.name, 'expected': 0, 'actual': ingredient.stock, 'kind': 'negative_stock'})
+        return violations
+
+    def report(self, elapsed):
+        operations = {}
+        for operation, samples in self.latencies.items():
+            operations[operation] = {
+                'count': len(samples),
+                'throughput': len(samples) / elapsed if elapsed else 0.0,
+                'p50_ms': percentile(samples, 0.50) * 1000,
+                'p95_ms': percentile(samples, 0.95) * 1000,
+                'p99_ms': percentile(samples, 0.99) * 1000,
+            }
+        return {
+            'elapsed': elapsed,
+            'operations': operations,
+            'stock_violations': self.stock_violations(),
+            'errors': self.errors,
+        }
+
+
+def compare_reports(baseline, current, tolerance=0.2):
+    # Flags operations whose p95 regressed by more than the tolerance
+    regressions = {}
+    for operation, stats in current['operations'].items():
+        before = baseline.get('operations', {}).get(operation)
+        if before and before['p95_ms'] and stats['p95_ms'] > before['p95_ms'] * (1 + tolerance):
+            regressions[operation] = {'baseline_p95_ms': before['p95_ms'], 'p95_ms': stats['p95_ms']}
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate concurrent customers and tills against the pizza store.")
+    parser.add_argument('--data', default='data.json')
+    parser.add_argument('--tills', type=int, default=4)
+    parser.add_argument('--rate', type=float, default=20.0, help="orders and edits per second across all tills")
+    parser.add_argument('--duration', type=float, default=10.0, help="seconds")
+    parser.add_argument('--mix', help="JSON file mapping menu item names to relative weights")
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--record', help="write the generated orders to this log file")
+    parser.add_argument('--replay', help="replay orders from this log file instead of generating them")
+    parser.add_argument('--realtime', action='store_true', help="keep the recorded timing when replaying")
+    parser.add_argument('--baseline', help="report JSON to compare p95 latencies against")
+    parser.add_argument('--output', help="write the report JSON to this file")
+    args = parser.parse_args()
+
+    order_mix = None
+    if args.mix:
+        with open(args.mix, 'r') as file:
+            order_mix = json.load(file)
+
+    load_test = LoadTest(args.data, tills=args.tills, rate=args.rate, duration=args.duration, order_mix=order_mix, seed=args.seed)
+    try:
+        if args.replay:
+            with open(args.replay, 'r') as file:
+                report = load_test.replay(json.load(file), realtime=args.realtime)
+        else:
+            report = load_test.run()
+            if args.record:
+                with open(args.record, 'w') as file:
+                    json.dump(load_test.order_log, file)
+    finally:
+        load_test.cleanup()
+
+    if args.baseline:
+        with open(args.baseline, 'r') as file:
+            report['regressions'] = compare_reports(json.load(file), report)
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
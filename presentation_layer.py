@@ -1,17 +1,27 @@
-import json
+import logging
+import os
+import queue
+import sys
+import threading
 import tkinter as tk
 from abc import ABC, abstractmethod
 from tkinter import ttk, messagebox, simpledialog
-from data_layer import Recipe, AbstractInventory, Menu, Order
-from business_layer import AbstractStore, RecipeManager, InventoryManager, PizzaMenuStore
+from data_layer import Recipe, PizzaStore, AbstractInventory, Order, StoreRouter, ChangeLog, event_bus
+from business_layer import (AbstractStore, RecipeManager, InventoryManager, PizzaMenuStore, CostCalculator, EditSession,
+                            AddMenuItemCommand, UpdateMenuItemCommand, DeleteMenuItemCommand, ALLERGENS,
+                            profile_mask, describe_mask, TicketPipeline, menu_view_cache, SyncEngine,
+                            SlotScheduler)
+
+logger = logging.getLogger(__name__)
 
 
 #  RECIPE  MANAGEMENT
 class AbstractRecipeForm(tk.Toplevel, ABC):
-    def __init__(self, parent, manager, recipe=None):
+    def __init__(self, parent, manager, recipe=None, data_file='data.json'):
         super().__init__(parent)
         self.manager = manager
         self.recipe = recipe
+        self.data_file = data_file
         if self.recipe:
             self.title("Update Recipe")
         else:
@@ -55,22 +65,23 @@ class RecipeForm(AbstractRecipeForm):
         ingredients = self.ingredients_entry.get().split(',')
 
         if self.recipe:
-            new_recipe = Recipe(name, category, ingredients)
+            new_recipe = Recipe(name, category, ingredients, self.recipe.quantities)
             self.manager.update_recipe(self.recipe, new_recipe)
         else:
             new_recipe = Recipe(name, category, ingredients)
             self.manager.add_recipe(new_recipe)
 
-        self.manager.save_to_file('data.json')
+        self.manager.save_to_file(self.data_file)
         self.destroy()
 
 class RecipeManagement:
-    def __init__(self, root, manager: AbstractStore):
+    def __init__(self, root, manager: AbstractStore, data_file='data.json'):
         self.root = root
         self.root.title("Pizza Store Recipe Management")
         self.root.geometry("800x600")
 
         self.manager = manager
+        self.data_file = data_file
 
         self.manage_frame = ttk.Frame(root)
         self.manage_frame.pack()
@@ -84,8 +95,18 @@ class RecipeManagement:
         self.search_button = ttk.Button(self.manage_frame, text="Search Recipes", command=self.search_recipes)
         self.search_button.pack(pady=5)
 
+        self.category_filter = ttk.Combobox(self.manage_frame, values=["", "Vegetarian", "Meat Lovers", "Specialty"], state="readonly")
+        self.category_filter.pack(pady=5)
+
+        self.diet_filter = ttk.Combobox(self.manage_frame, values=["", "vegetarian", "vegan"], state="readonly")
+        self.diet_filter.pack(pady=5)
+
+        self.filter_button = ttk.Button(self.manage_frame, text="Filter Recipes", command=self.filter_recipes)
+        self.filter_button.pack(pady=5)
+
         self.recipe_listbox = tk.Listbox(self.manage_frame, selectmode=tk.SINGLE)
         self.recipe_listbox.pack(pady=10)
+        self.displayed_recipes = []
 
         self.view_button = ttk.Button(self.manage_frame, text="View Recipe", command=self.view_recipe)
         self.view_button.pack(pady=5)
@@ -100,7 +121,7 @@ class RecipeManagement:
         self.delete_button.pack(pady=5)
 
     def load_recipes(self):
-        self.manager.load_from_file('data.json')
+        self.manager.load_from_file(self.data_file)
         self.update_recipe_listbox()
     
     def search_recipes(self):
@@ -111,29 +132,38 @@ class RecipeManagement:
         else:
             messagebox.showwarning("Empty Search", "Please enter a search term.")
 
+    def filter_recipes(self):
+        selection = {}
+        if self.category_filter.get():
+            selection['category'] = [self.category_filter.get()]
+        if self.diet_filter.get():
+            selection['diet'] = [self.diet_filter.get()]
+        self.update_recipe_listbox(recipes=self.manager.filter_recipes(selection))
+
     def update_recipe_listbox(self, recipes=None):
         self.recipe_listbox.delete(0, tk.END)
-        recipes = recipes or self.manager.get_all_recipes()
+        recipes = self.manager.get_all_recipes() if recipes is None else recipes
+        self.displayed_recipes = list(recipes)
         for recipe in recipes:
             self.recipe_listbox.insert(tk.END, f"{recipe.name} - {recipe.category}")
 
     def view_recipe(self):
         selected_index = self.recipe_listbox.curselection()
         if selected_index:
-            selected_recipe = self.manager.get_all_recipes()[selected_index[0]]
+            selected_recipe = self.displayed_recipes[selected_index[0]]
             messagebox.showinfo("Recipe Details", f"Name: {selected_recipe.name}\nCategory: {selected_recipe.category}\nIngredients: {', '.join(selected_recipe.ingredients)}")
         else:
             messagebox.showwarning("No Recipe Selected", "Please select a recipe to view.")
 
     def add_recipe(self):
-        RecipeForm(self.root, self.manager)
+        RecipeForm(self.root, self.manager, data_file=self.data_file)
         self.update_recipe_listbox()
 
     def update_recipe(self):
         selected_index = self.recipe_listbox.curselection()
         if selected_index:
-            selected_recipe = self.manager.get_all_recipes()[selected_index[0]]
-            RecipeForm(self.root, self.manager, recipe=selected_recipe)
+            selected_recipe = self.displayed_recipes[selected_index[0]]
+            RecipeForm(self.root, self.manager, recipe=selected_recipe, data_file=self.data_file)
             self.update_recipe_listbox()
         else:
             messagebox.showwarning("No Recipe Selected", "Please select a recipe to update.")
@@ -141,11 +171,11 @@ class RecipeManagement:
     def delete_recipe(self):
         selected_index = self.recipe_listbox.curselection()
         if selected_index:
-            selected_recipe = self.manager.get_all_recipes()[selected_index[0]]
+            selected_recipe = self.displayed_recipes[selected_index[0]]
             response = messagebox.askyesno("Confirm Deletion", f"Do you want to delete the recipe: {selected_recipe.name}?")
             if response:
                 self.manager.delete_recipe(selected_recipe)
-                self.manager.save_to_file('data.json')
+                self.manager.save_to_file(self.data_file)
                 self.update_recipe_listbox()
         else:
             messagebox.showwarning("No Recipe Selected", "Please select a recipe to delete.")
@@ -178,17 +208,18 @@ class AbstractInventoryApp(tk.Tk, ABC):
         pass
 
 class InventoryManagement(AbstractInventoryApp):
-    def __init__(self, root, manager: InventoryManager):
+    def __init__(self, root, manager: InventoryManager, data_file='data.json'):
         super().__init__(root)
         self.root = root
         self.root.title("Pizza Store Inventory")
+        self.data_file = data_file
 
         # Create inventory manager
         self.inventory_manager = manager
 
         # Load existing data from JSON
         try:
-            self.inventory_manager.load_inventory_from_json('data.json')
+            self.inventory_manager.load_inventory_from_json(self.data_file)
         except FileNotFoundError:
             pass  # File doesn't exist yet
 
@@ -196,9 +227,10 @@ class InventoryManagement(AbstractInventoryApp):
         self.label = ttk.Label(root, text="Ingredient Inventory")
         self.label.pack()
 
-        self.tree = ttk.Treeview(root, columns=('Name', 'Stock'), show='headings')
+        self.tree = ttk.Treeview(root, columns=('Name', 'Stock', 'Cost'), show='headings')
         self.tree.heading('Name', text='Name')
         self.tree.heading('Stock', text='Stock')
+        self.tree.heading('Cost', text='Unit Cost')
         self.tree.pack()
 
         self.refresh_button = ttk.Button(root, text='Refresh', command=self.refresh_inventory)
@@ -213,6 +245,12 @@ class InventoryManagement(AbstractInventoryApp):
         self.delete_button = ttk.Button(root, text='Delete Ingredient', command=self.delete_ingredient)
         self.delete_button.pack(side=tk.LEFT, padx=5, pady=(10, 5))
 
+        self.cost_button = ttk.Button(root, text='Update Cost', command=self.update_ingredient_cost)
+        self.cost_button.pack(side=tk.LEFT, padx=5, pady=(10, 5))
+
+        self.reorder_button = ttk.Button(root, text='Reorder Suggestions', command=self.show_reorder_suggestions)
+        self.reorder_button.pack(side=tk.LEFT, padx=5, pady=(10, 5))
+
         # Save data on window close
         root.protocol("WM_DELETE_WINDOW", self.on_close)
 
@@ -223,7 +261,7 @@ class InventoryManagement(AbstractInventoryApp):
 
         # Populate the treeview with inventory data
         for ingredient in self.inventory_manager.get_inventory():
-            self.tree.insert('', 'end', values=(ingredient.name, ingredient.stock))
+            self.tree.insert('', 'end', values=(ingredient.name, ingredient.stock, f"{ingredient.cost:.2f}"))
 
     def add_ingredient(self):
         # Prompt the user for ingredient details using a pop-up window
@@ -254,16 +292,36 @@ class InventoryManagement(AbstractInventoryApp):
                 self.inventory_manager.update_ingredient(ingredient_name, new_stock)
                 self.refresh_inventory()
 
+    def update_ingredient_cost(self):
+        selected_item = self.tree.selection()
+        if selected_item:
+            ingredient_name = self.tree.item(selected_item, 'values')[0]
+            new_cost = simpledialog.askfloat("Update Cost", f"Enter unit cost for {ingredient_name}:")
+            if new_cost is not None:
+                self.inventory_manager.update_ingredient_cost(ingredient_name, new_cost)
+                self.refresh_inventory()
+
+    def show_reorder_suggestions(self):
+        suggestions = [item for item in self.inventory_manager.get_reorder_suggestions() if item['suggested_quantity'] > 0]
+        if not suggestions:
+            messagebox.showinfo("Reorder Suggestions", "Stock levels are sufficient.")
+            return
+        lines = [f"{item['name']}: order {item['suggested_quantity']} (stock {item['stock']}, reorder at {item['reorder_point']:.1f})"
+                 for item in suggestions]
+        messagebox.showinfo("Reorder Suggestions", "\n".join(lines))
+
     def on_close(self):
         # Save data to JSON on window close
-        self.inventory_manager.save_inventory_to_json('data.json')
+        self.inventory_manager.save_inventory_to_json(self.data_file)
         self.root.destroy()
 
 #  MENU  MANAGEMENT
 class PizzaMenuApp:
-    def __init__(self, root, pizza_store):
+    def __init__(self, root, pizza_store, cost_calculator=None):
         self.root = root
         self.pizza_store = pizza_store
+        self.cost_calculator = cost_calculator
+        self.session = EditSession(menu_store=pizza_store)
         self.root.title("Pizza Store Menu Management")
         self.root.geometry("800x600")
 
@@ -289,6 +347,15 @@ class PizzaMenuApp:
         self.delete_button = tk.Button(self.menu_frame, text="Delete Item", command=self.delete_item)
         self.delete_button.grid(row=0, column=4, padx=10, pady=10)
 
+        self.margins_button = tk.Button(self.menu_frame, text="View Margins", command=self.show_margins)
+        self.margins_button.grid(row=0, column=5, padx=10, pady=10)
+
+        self.undo_button = tk.Button(self.menu_frame, text="Undo", command=self.undo)
+        self.undo_button.grid(row=1, column=0, padx=10, pady=10)
+
+        self.redo_button = tk.Button(self.menu_frame, text="Redo", command=self.redo)
+        self.redo_button.grid(row=1, column=1, padx=10, pady=10)
+
         self.menu_treeview = ttk.Treeview(self.root, columns=('Description', 'Price'))
         self.menu_treeview.heading('#0', text='Item')
         self.menu_treeview.heading('Description', text='Description')
@@ -296,13 +363,12 @@ class PizzaMenuApp:
         self.menu_treeview.pack(padx=10, pady=10)
 
     def show_pizza_form(self, item_name=None):
-        pizza_form = PizzaForm(self.root, self.pizza_store, 'Pizza', item_name)
+        pizza_form = PizzaForm(self.root, self.pizza_store, self.session, 'Pizza', item_name)
 
     def show_side_dish_form(self, item_name=None):
-        side_dish_form = PizzaForm(self.root, self.pizza_store, 'Side Dish', item_name)
+        side_dish_form = PizzaForm(self.root, self.pizza_store, self.session, 'Side Dish', item_name)
 
     def load_data(self):
-        self.pizza_store.data_handler.load_menu()
         self.pizza_store.load_data()
         self.menu_treeview.delete(*self.menu_treeview.get_children())
 
@@ -349,9 +415,42 @@ class PizzaMenuApp:
 
         result = messagebox.askyesno("Confirm Deletion", f"Are you sure you want to delete {item_name}?")
         if result:
-            self.pizza_store.delete_item_from_menu(item_category, item_name)
+            self.session.execute(DeleteMenuItemCommand(self.pizza_store, item_category, item_name))
+            self.load_data()
+
+    def undo(self):
+        if self.session.can_undo():
+            self.session.undo()
             self.load_data()
 
+    def redo(self):
+        if self.session.can_redo():
+            self.session.redo()
+            self.load_data()
+
+    def show_margins(self):
+        if not self.cost_calculator:
+            messagebox.showwarning("Error", "No cost data available.")
+            return
+
+        margins_window = tk.Toplevel(self.root)
+        margins_window.title("Menu Margins")
+        margins_treeview = ttk.Treeview(margins_window, columns=('Price', 'Cost', 'Margin'))
+        margins_treeview.heading('#0', text='Item')
+        margins_treeview.heading('Price', text='Price')
+        margins_treeview.heading('Cost', text='Food Cost')
+        margins_treeview.heading('Margin', text='Margin')
+        margins_treeview.pack(padx=10, pady=10)
+
+        for category, items in self.cost_calculator.menu_margins(self.pizza_store.menu).items():
+            category_heading = margins_treeview.insert('', 'end', text=category, open=True)
+            for item in items:
+                if item['cost'] is None:
+                    values = (f"${item['price']:.2f}", 'n/a', 'n/a')
+                else:
+                    values = (f"${item['price']:.2f}", f"${item['cost']:.2f}", f"${item['margin']:.2f} ({item['margin_percent'] or 0:.0f}%)")
+                margins_treeview.insert(category_heading, 'end', text=item['name'], values=values)
+
     def get_item_category(self, item_name):
         for category, items in self.pizza_store.menu.items():
             if any(item['name'] == item_name for item in items):
@@ -359,8 +458,9 @@ class PizzaMenuApp:
 
 # Form for adding Pizzas and Side Dishes
 class PizzaForm:
-    def __init__(self, parent, pizza_store, item_type, item_name=None):
+    def __init__(self, parent, pizza_store, session, item_type, item_name=None):
         self.pizza_store = pizza_store
+        self.session = session
         self.form = tk.Toplevel(parent)
         self.form.title(f"Add {item_type}")
         self.form.geometry("400x300")
@@ -375,7 +475,10 @@ class PizzaForm:
             self.description_entry.insert(0, item.get('description', ''))
             self.price_entry.insert(0, item.get('price', ''))
             if hasattr(self, 'ingredients_entry'):
-                self.ingredients_entry.insert(0, item.get('ingredients', ''))
+                ingredients = item.get('ingredients', '')
+                if isinstance(ingredients, list):
+                    ingredients = ', '.join(ingredients)
+                self.ingredients_entry.insert(0, ingredients)
 
     def add_item(self):
         name = self.name_entry.get()
@@ -383,22 +486,18 @@ class PizzaForm:
         price = float(self.price_entry.get())
 
         if hasattr(self, 'ingredients_entry'):
-            ingredients = self.ingredients_entry.get()
+            ingredients = [ingredient.strip() for ingredient in self.ingredients_entry.get().split(',') if ingredient.strip()]
             category = "Pizza"
-            if self.item_name:
-                # Update existing item
-                self.pizza_store.update_pizza_in_menu(self.item_name, name, description, ingredients, price)
-            else:
-                # Add new item
-                self.pizza_store.add_pizza_to_menu(name, description, ingredients, price)
         else:
+            ingredients = None
             category = "Side Dish"
-            if self.item_name:
-                # Update existing item
-                self.pizza_store.update_side_dish_in_menu(self.item_name, name, description, price)
-            else:
-                # Add new item
-                self.pizza_store.add_side_dish_to_menu(name, description, price)
+
+        if self.item_name:
+            # Update existing item
+            self.session.execute(UpdateMenuItemCommand(self.pizza_store, category, self.item_name, name, description, price, ingredients))
+        else:
+            # Add new item
+            self.session.execute(AddMenuItemCommand(self.pizza_store, category, name, description, price, ingredients))
 
         messagebox.showinfo("Item Added", f"{name} {'' if self.item_name else 'added to'} the menu.")
         self.form.destroy()
@@ -428,17 +527,26 @@ class PizzaForm:
 
 #  CUSTOMER  ORDER
 class CustomerOrderApp:
-    def __init__(self, root):
+    def __init__(self, root, router=None, tickets=None, scheduler=None):
         self.root = root
         self.root.title("Pizza Store Application")
-
-        # Load menu and inventory data from the 'menu' and 'inventory' keys in data.json
-        data = self.load_data("data.json")
-        self.menu = data.get("menu", {})
-        self.inventory = data.get("inventory", {})
+        self.tickets = tickets or TicketPipeline()
+        self.scheduler = scheduler
+
+        # The menu, stock and dietary data are shared by every customer window until the menu changes
+        self.router = router or StoreRouter()
+        self.menu_view = menu_view_cache.get(self.router)
+        self.menu = self.menu_view.menu
+        self.inventory = self.menu_view.inventory
+        self.dietary_engine = self.menu_view.dietary_engine
+        self.diet_vars = {diet: tk.IntVar() for diet in ("vegetarian", "vegan", "gluten_free")}
+        self.allergen_vars = {allergen: tk.IntVar() for allergen in ALLERGENS if allergen != "gluten"}
+        self.price_band_var = tk.StringVar()
 
         # Initialize the order
         self.order = Order()
+        self.last_order = None
+        self.order_rows = {}
 
         # Create UI elements
         self.create_menu_frame()
@@ -455,7 +563,8 @@ class CustomerOrderApp:
         self.menu_tree.heading("Description", text="Description")
         self.menu_tree.heading("Price", text="Price")
         self.menu_tree.column("Description", width=200)
-        self.menu_tree.column("Price", width=50)
+        self.menu_tree.column("Price", width=60)
+        self.menu_tree.tag_configure("unavailable", foreground="gray")
 
         self.populate_menu()
 
@@ -467,6 +576,32 @@ class CustomerOrderApp:
         create_own_pizza_button = ttk.Button(menu_frame, text="Create Your Own Pizza", command=self.create_own_pizza)
         create_own_pizza_button.grid(row=2, column=0, pady=5)
 
+        profile_frame = ttk.LabelFrame(menu_frame, text="Dietary Profile")
+        profile_frame.grid(row=3, column=0, padx=10, pady=5, sticky="ew")
+        for column, (diet, var) in enumerate(self.diet_vars.items()):
+            ttk.Checkbutton(profile_frame, text=diet.replace("_", " ").title(), variable=var,
+                            command=self.populate_menu).grid(row=0, column=column, sticky="w", padx=5)
+        for column, (allergen, var) in enumerate(self.allergen_vars.items()):
+            ttk.Checkbutton(profile_frame, text=f"No {allergen}", variable=var,
+                            command=self.populate_menu).grid(row=1, column=column, sticky="w", padx=5)
+
+        price_bands = sorted(self.menu_view.facet_counts().get("price_band", {}), key=lambda band: float(band.split("-")[0].rstrip("+")))
+        price_frame = ttk.Frame(menu_frame)
+        price_frame.grid(row=4, column=0, padx=10, pady=5, sticky="ew")
+        ttk.Label(price_frame, text="Price:").grid(row=0, column=0, padx=5)
+        price_combobox = ttk.Combobox(price_frame, values=[""] + price_bands, textvariable=self.price_band_var, state="readonly")
+        price_combobox.grid(row=0, column=1, padx=5)
+        price_combobox.bind("<<ComboboxSelected>>", lambda event: self.populate_menu())
+
+    def dietary_profile(self):
+        return profile_mask([diet for diet, var in self.diet_vars.items() if var.get()],
+                            [allergen for allergen, var in self.allergen_vars.items() if var.get()])
+
+    def warn_if_unsuitable(self, item):
+        conflicts = self.dietary_engine.item_mask(item) & self.dietary_profile()
+        if conflicts:
+            messagebox.showwarning("Dietary Warning", f"{item['name']} is not suitable: {', '.join(describe_mask(conflicts))}")
+
     def create_order_frame(self):
         order_frame = ttk.LabelFrame(self.root, text="Order")
         order_frame.grid(row=0, column=1, padx=10, pady=10, sticky="nsew")
@@ -480,26 +615,39 @@ class CustomerOrderApp:
 
         self.order_tree.grid(row=0, column=0, padx=10, pady=10, sticky="nsew")
 
+        self.fulfillment_var = tk.StringVar(value="pickup")
+        fulfillment_combobox = ttk.Combobox(order_frame, values=["pickup", "delivery"], textvariable=self.fulfillment_var, state="readonly")
+        fulfillment_combobox.grid(row=1, column=0, pady=5)
+
         place_order_button = ttk.Button(order_frame, text="Place Order", command=self.place_order)
-        place_order_button.grid(row=1, column=0, pady=5)
+        place_order_button.grid(row=2, column=0, pady=5)
+
+        repeat_order_button = ttk.Button(order_frame, text="Repeat Last Order", command=self.repeat_last_order)
+        repeat_order_button.grid(row=3, column=0, pady=5)
 
     def populate_menu(self):
-        for category, items in self.menu.items():
+        self.menu_tree.delete(*self.menu_tree.get_children())
+        selection = {"price_band": [self.price_band_var.get()]} if self.price_band_var.get() else None
+        for category, rows in self.menu_view.groups_for(self.dietary_profile(), selection):
             category_node = self.menu_tree.insert("", "end", text=category)
-            for item in items:
-                self.menu_tree.insert(category_node, "end", text=item["name"],
-                                      values=(item["description"], item["price"]))
+            for row in rows:
+                self.menu_tree.insert(category_node, "end", text=row["name"], values=(row["description"], row["price_text"]),
+                                      tags=() if row["available"] else ("unavailable",))
 
     def add_to_order(self):
         selected_item = self.menu_tree.selection()
         if selected_item:
             item_name = self.menu_tree.item(selected_item, "text")
+            if "unavailable" in self.menu_tree.item(selected_item, "tags"):
+                messagebox.showinfo("Add to Order", f"{item_name} is currently unavailable.")
+                return
             quantity = self.get_quantity()
             if quantity > 0:
                 item = self.find_item_by_name(item_name)
                 total_price = quantity * item["price"]
-                self.order.add_item(item_name, quantity, total_price)
-                self.update_order_tree()
+                line = self.order.add_item(item_name, quantity, total_price)
+                self.update_order_lines([line])
+                self.warn_if_unsuitable(item)
 
     def create_own_pizza(self):
         own_pizza_dialog = tk.Toplevel(self.root)
@@ -518,7 +666,9 @@ class CustomerOrderApp:
         for ingredient in self.inventory:
             ingredient_name = ingredient["name"]
             ingredient_var = tk.IntVar()
-            ingredient_checkbutton = ttk.Checkbutton(own_pizza_dialog, text=ingredient_name, variable=ingredient_var)
+            labels = describe_mask(self.dietary_engine.ingredient_mask(ingredient_name))
+            ingredient_text = f"{ingredient_name} ({', '.join(labels)})" if labels else ingredient_name
+            ingredient_checkbutton = ttk.Checkbutton(own_pizza_dialog, text=ingredient_text, variable=ingredient_var)
             ingredient_checkbutton.grid(sticky="w", padx=10)
             self.own_pizza_ingredients[ingredient_name] = {"var": ingredient_var, "stock": ingredient["stock"]}
 
@@ -546,8 +696,15 @@ class CustomerOrderApp:
             own_pizza_price = 8.0  # Set your own price for the custom pizza
             total_price = quantity * own_pizza_price
             pizza_name = f"Custom Pizza ({own_pizza_base}, {own_pizza_sauce})"
-            self.order.add_item(pizza_name, quantity, total_price, ingredients=own_pizza_ingredients)
-            self.update_order_tree()
+            line = self.order.add_item(pizza_name, quantity, total_price, ingredients=own_pizza_ingredients)
+            self.update_order_lines([line])
+            self.warn_if_unsuitable(line)
+
+    def repeat_last_order(self):
+        if not self.last_order:
+            messagebox.showinfo("Repeat Last Order", "No previous order to repeat.")
+            return
+        self.update_order_lines(self.order.add_items(self.last_order.get_items()))
 
     def place_order(self):
         order_details = self.order.get_order_details()
@@ -555,53 +712,92 @@ class CustomerOrderApp:
             messagebox.showinfo("Place Order", "No items in the order. Please add items to the order.")
             return
 
-        # Calculate total bill
-        total_bill = sum(item["total_price"] for item in order_details["items"])
+        if self.scheduler:
+            try:
+                self.scheduler.book(self.order, kind=self.fulfillment_var.get())
+            except ValueError as error:
+                messagebox.showwarning("Place Order", f"{error}. Please try a smaller order.")
+                return
+
+        # Receipts and kitchen tickets are rendered and spooled in the background
+        order_number = self.tickets.submit(self.order)
+        self.order.place(order_number)
 
         # Display order summary popup
-        summary_text = "Order Summary:\n"
-        for item in order_details["items"]:
-            summary_text += f"{item['name']}"
-            if item.get("ingredients"):
-                summary_text += f" - {', '.join(item['ingredients'])}"
-            summary_text += f" - {item['quantity']} x ${item['total_price']:.2f}\n"
-
-        summary_text += f"\nTotal Bill: ${total_bill:.2f}"
+        summary_parts = [self.tickets.renderer.render_receipt(self.order, order_number)]
+        warnings = self.dietary_engine.order_warnings(self.order, self.dietary_profile(), self.menu)
+        if warnings:
+            summary_parts.append("Allergen Information:\n" + "\n".join(warnings))
 
-        messagebox.showinfo("Place Order", summary_text)
+        messagebox.showinfo("Place Order", "\n".join(summary_parts))
 
-        # You can further implement actions like updating inventory, generating order slips, etc.
+        self.last_order = self.order.clone()
         self.clear_order()
 
+    def clear_order(self):
+        self.order = Order()
+        self.update_order_tree()
+
     def update_order_tree(self):
         self.order_tree.delete(*self.order_tree.get_children())
-        for item in self.order.get_items():
-            self.order_tree.insert("", "end", text=item["name"],
-                                   values=(item["quantity"], item["total_price"]))
+        self.order_rows = {}
+        self.update_order_lines(self.order.get_items())
+
+    def update_order_lines(self, items):
+        # Only touch the rows for lines that were added or merged into
+        for item in items:
+            values = (item["quantity"], item["total_price"])
+            row = self.order_rows.get(id(item))
+            if row is None:
+                self.order_rows[id(item)] = self.order_tree.insert("", "end", text=item["name"], values=values)
+            else:
+                self.order_tree.item(row, values=values)
 
     def get_quantity(self):
         quantity = simpledialog.askinteger("Quantity", "Enter quantity:")
         return quantity if quantity else 0
 
     def find_item_by_name(self, item_name):
-        for category, items in self.menu.items():
-            for item in items:
-                if item["name"] == item_name:
-                    return item
-        return None
-
-    def load_data(self, filename):
-        with open(filename, "r") as file:
-            data = json.load(file)
-        return data
+        return self.menu_view.find_item(item_name)
 
 
 class PizzaStoreApp:
-    def __init__(self, root):
+    def __init__(self, root, router=None, sync_engine=None):
         self.root = root
         self.root.title("Pizza Store App")
         self.root.geometry("800x600") 
 
+        # Recipes are shared across the chain, stock and menu come from the active store
+        self.router = router or StoreRouter()
+        self.tickets = TicketPipeline()
+
+        # Pickup and delivery slots are shared by every customer window
+        recipe_store = PizzaStore()
+        recipe_store.load_from_file(self.router.catalog_file)
+        bookings_file = os.path.splitext(self.router.store_file())[0] + '.bookings'
+        self.scheduler = SlotScheduler(recipe_store.get_all_recipes(), self.router.load_menu(),
+                                       store_id=self.router.active_store, bookings_file=bookings_file)
+        self.scheduler.attach(event_bus)
+
+        # Food costs follow price changes and recipe edits for as long as the app runs
+        self.cost_calculator = CostCalculator(recipe_store.get_all_recipes(), self.router.load_inventory().get_ingredients())
+        self.cost_calculator.attach(event_bus)
+
+        # Every change made through the app is recorded for downstream consumers
+        self.change_log = ChangeLog()
+        self.change_log.attach(event_bus)
+
+        # Exchange changes with the other tills in the background when a sync folder is configured
+        self.sync_engine = sync_engine
+        self.sync_results = queue.Queue()
+        if self.sync_engine:
+            self.sync_engine.attach(event_bus)
+            self.sync_engine.track(self.scheduler)
+            self.root.after(5000, self.sync)
+
+        # Queued tickets are printed before the app exits
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+
         # List to store the pages
         self.pages = []
 
@@ -697,25 +893,71 @@ class PizzaStoreApp:
 
         self.show_page(customer_frame)
 
+    def track_window(self, window, copy):
+        # Changes synced from other tills also go into the copy an open window saves from
+        if not self.sync_engine:
+            return
+        self.sync_engine.track(copy)
+
+        def untrack(event):
+            if event.widget is window:
+                self.sync_engine.untrack(copy)
+        window.bind("<Destroy>", untrack, add="+")
+
     def recipe_management_page(self):
         pizza_store_root = tk.Toplevel(self.root)
         manager = RecipeManager()
-        pizza_store_app = RecipeManagement(pizza_store_root, manager)
+        pizza_store_app = RecipeManagement(pizza_store_root, manager, data_file=self.router.catalog_file)
+        self.track_window(pizza_store_root, manager)
 
     def inventory_management_page(self):
         pizza_store_root = tk.Toplevel(self.root)
-        inventory_manager = InventoryManager(AbstractInventory())
-        pizza_store_app = InventoryManagement(pizza_store_root, inventory_manager)
+        inventory_manager = InventoryManager(AbstractInventory(self.router.active_store))
+        pizza_store_app = InventoryManagement(pizza_store_root, inventory_manager, data_file=self.router.store_file())
+        self.track_window(pizza_store_root, inventory_manager.inventory)
 
     def menu_management_page(self):
         pizza_store_root = tk.Toplevel(self.root)
-        data_handler = Menu()
+        data_handler = self.router.menu_handler()
         pizza_store = PizzaMenuStore(data_handler)
-        pizza_store_app = PizzaMenuApp(pizza_store_root, pizza_store)
+        pizza_store_app = PizzaMenuApp(pizza_store_root, pizza_store, self.cost_calculator)
+        self.track_window(pizza_store_root, pizza_store)
 
     def menu_page(self):
         pizza_store_root = tk.Toplevel(self.root)
-        pizza_store_app = CustomerOrderApp(pizza_store_root)
+        pizza_store_app = CustomerOrderApp(pizza_store_root, router=self.router, tickets=self.tickets, scheduler=self.scheduler)
+
+    def sync(self):
+        # Reading the other tills' logs and rewriting the files happens on a worker thread,
+        # the open windows are updated back on the UI thread once it is done
+        threading.Thread(target=self.pull_changes, daemon=True).start()
+        self.root.after(200, self.deliver_changes)
+
+    def pull_changes(self):
+        try:
+            self.sync_results.put(self.sync_engine.pull())
+        except Exception as error:
+            self.sync_results.put(error)
+
+    def deliver_changes(self):
+        try:
+            result = self.sync_results.get_nowait()
+        except queue.Empty:
+            self.root.after(200, self.deliver_changes)
+            return
+        try:
+            if isinstance(result, OSError):
+                pass  # Sync folder unreachable, keep working offline and retry later
+            elif isinstance(result, Exception):
+                logger.error("Sync failed", exc_info=result)
+            else:
+                self.sync_engine.deliver(result)
+        finally:
+            self.root.after(5000, self.sync)
+
+    def on_close(self):
+        self.tickets.close()
+        self.root.destroy()
 
     def go_back(self):
         # Go back to the previous page
@@ -728,5 +970,14 @@ class PizzaStoreApp:
 
 if __name__ == "__main__":
     root = tk.Tk()
-    app = PizzaStoreApp(root)
+    # Optionally run as a specific store, syncing with other tills: python presentation_layer.py <store_id> [sync_dir]
+    store_id = sys.argv[1] if len(sys.argv) > 1 else None
+    router = StoreRouter(active_store=store_id)
+    sync_engine = SyncEngine(sys.argv[2], router) if len(sys.argv) > 2 else None
+    app = PizzaStoreApp(root, router, sync_engine)
+
+    # Diagnostic mode for long-running kiosks: PIZZA_MEMORY_PROFILE=<seconds between samples>
+    if os.environ.get("PIZZA_MEMORY_PROFILE"):
+        from diagnostics import MemoryProfiler
+        MemoryProfiler(root, interval_seconds=float(os.environ["PIZZA_MEMORY_PROFILE"])).start()
     root.mainloop()
\ No newline at end of file
@@ -0,0 +1,33 @@
+import argparse
+import json
+import sys
+from business_layer import CatalogValidator
+
+
+#  CATALOG  VALIDATION
+def main():
+    parser = argparse.ArgumentParser(description="Check the pizza store data files for integrity problems, e.g. from a nightly job.")
+    parser.add_argument('files', nargs='*', default=['data.json'], help="data files to check (default: data.json)")
+    parser.add_argument('--fix', action='store_true', help="repair what can be repaired without guessing and save the files")
+    parser.add_argument('--workers', type=int, help="worker processes for large catalogs")
+    parser.add_argument('--output', help="write the reports JSON to this file")
+    args = parser.parse_args()
+
+    validator = CatalogValidator(max_workers=args.workers)
+    reports = {filename: validator.validate_file(filename, fix=args.fix) for filename in args.files}
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(reports, file, indent=2)
+    for filename, report in reports.items():
+        print(f"{filename}: {report['issue_count']} issues {json.dumps(report['summary'])}")
+        if 'fixed' in report:
+            print(f"{filename}: {report['fixed']['issue_count']} issues left after fixing")
+
+    # A non-zero exit status lets the scheduler running the check flag the night's run
+    valid = all(report.get('fixed', report)['valid'] for report in reports.values())
+    return 0 if valid else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())